@@ -0,0 +1,207 @@
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+import database
+import memory_maintenance
+from typing import Dict, List, Optional
+
+# every archive is written here before it is queued, and marked done once it is stored,
+# so archives that were pending when the process died are replayed on the next start
+JOURNAL_FILE = ".archive_journal.jsonl"
+
+# how many archives are summarized and persisted together
+BATCH_SIZE = 4
+
+# how long the worker waits for more archives to fill a batch
+BATCH_WAIT_SECONDS = 2.0
+
+# a batch that couldn't be stored is queued again after this long, doubling on every failure up to
+# RETRY_MAX_SECONDS, so memories are still saved after an outage without restarting
+RETRY_BASE_SECONDS = 30.0
+RETRY_MAX_SECONDS = 15 * 60.0
+
+# how long exit waits for pending archives before leaving them in the journal for next time
+EXIT_TIMEOUT_SECONDS = 15.0
+
+QUEUE: "queue.Queue[Optional[dict]]" = queue.Queue()
+
+_JOURNAL_LOCK = threading.Lock()
+_START_LOCK = threading.Lock()
+_WORKER: Optional[threading.Thread] = None
+
+
+def _append_journal(records: List[dict]) -> None:
+    with _JOURNAL_LOCK:
+        with open(JOURNAL_FILE, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _pending_entries() -> List[dict]:
+    """
+    Reads the journal and returns the archives that were never marked done, oldest first.
+    """
+    pending: Dict[str, dict] = {}
+    try:
+        with open(JOURNAL_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a torn write from a crash, everything before it is still usable
+                    continue
+                if record["op"] == "add":
+                    pending[record["id"]] = record
+                elif record["op"] == "done":
+                    pending.pop(record["id"], None)
+    except FileNotFoundError:
+        pass
+    return list(pending.values())
+
+
+def _compact_journal() -> None:
+    """
+    Rewrites the journal with only the pending archives so it doesn't grow forever.
+    """
+    with _JOURNAL_LOCK:
+        pending = _pending_entries()
+        temp_path = JOURNAL_FILE + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for record in pending:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, JOURNAL_FILE)
+
+
+def start() -> None:
+    """
+    Starts the archival worker and queues any archives left pending by a previous run.
+    Safe to call more than once.
+    """
+    global _WORKER
+    with _START_LOCK:
+        if _WORKER is not None and _WORKER.is_alive():
+            return
+
+        pending = _pending_entries()
+        if pending:
+            print(f"Resuming {len(pending)} unsaved conversation archive(s).")
+        for record in pending:
+            QUEUE.put(record)
+
+        _WORKER = threading.Thread(target=_work, name="conversation-archiver", daemon=True)
+        _WORKER.start()
+
+
+def enqueue(archive: List[Dict[str, str]], learner_id: Optional[str] = None) -> None:
+    """
+    Records a conversation archive in the journal and hands it to the worker to be summarized
+    and stored. Returns as soon as the archive is safely on disk.
+
+    Args:
+        archive: A list of dictionary objects representing each message in the conversation.
+        learner_id: The learner the conversation's memory belongs to, see Session.learner_id.
+    """
+    if not archive:
+        return
+    # start first, so the replay of older pending archives doesn't pick this one up as well
+    start()
+    record = {"op": "add", "id": uuid.uuid4().hex, "created": time.time(), "archive": list(archive), "learner": learner_id}
+    _append_journal([record])
+    QUEUE.put(record)
+
+
+def _work() -> None:
+    # digests are written on this thread too, so they never compete with a turn for the chat model
+    memory_maintenance.maybe_run()
+    while True:
+        record = QUEUE.get()
+        if record is None:
+            QUEUE.task_done()
+            return
+
+        # collect whatever else arrives shortly after so it is persisted together
+        batch = [record]
+        deadline = time.monotonic() + BATCH_WAIT_SECONDS
+        stopping = False
+        while len(batch) < BATCH_SIZE:
+            try:
+                record = QUEUE.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if record is None:
+                stopping = True
+                break
+            batch.append(record)
+
+        try:
+            _archive_batch(batch)
+        except Exception as e:
+            # the batch stays pending in the journal, so it is also retried on the next start if the process exits first
+            print(f"Error while archiving conversation: {e}")
+            _retry_later(batch)
+        finally:
+            for _ in batch:
+                QUEUE.task_done()
+
+        memory_maintenance.maybe_run()
+
+        if stopping:
+            QUEUE.task_done()
+            return
+
+
+def _retry_later(batch: List[dict]) -> None:
+    """
+    Queues the archives of a failed batch again once their backoff has passed.
+    """
+    for record in batch:
+        # the retry count only lives in memory; the journal still has the record as it was added
+        record["retries"] = record.get("retries", 0) + 1
+    delay = min(RETRY_BASE_SECONDS * 2 ** (max(record["retries"] for record in batch) - 1), RETRY_MAX_SECONDS)
+
+    def requeue() -> None:
+        # once the worker has stopped, the journal replays them on the next start instead
+        if _WORKER is None or not _WORKER.is_alive():
+            return
+        for record in batch:
+            QUEUE.put(record)
+
+    timer = threading.Timer(delay, requeue)
+    timer.daemon = True
+    timer.start()
+
+
+def _archive_batch(batch: List[dict]) -> None:
+    summaries: List[str] = []
+    metadatas: List[Dict[str, str]] = []
+    for record in batch:
+        summary, metadata = database.summarize_conversation(record["archive"], record.get("learner"))
+        summaries.append(summary)
+        metadatas.append(metadata)
+
+    database.store_summaries(summaries, metadatas, [record["id"] for record in batch])
+    _append_journal([{"op": "done", "id": record["id"]} for record in batch])
+
+    if QUEUE.empty():
+        _compact_journal()
+
+
+def stop(timeout: Optional[float] = EXIT_TIMEOUT_SECONDS) -> None:
+    """
+    Lets the worker finish the queued archives and stops it, waiting at most timeout seconds.
+    Anything not stored by then stays in the journal and is replayed on the next start.
+
+    Args:
+        timeout (Optional[float]): How long to wait, or None to wait until everything is stored.
+    """
+    if _WORKER is None or not _WORKER.is_alive():
+        return
+    QUEUE.put(None)
+    _WORKER.join(timeout)
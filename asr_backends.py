@@ -0,0 +1,208 @@
+import threading
+import time
+import model_registry
+import numpy as np
+from typing import Any, Dict, Optional, Tuple, Type, Union
+
+WHISPER = "whisper"
+FASTER_WHISPER = "faster-whisper"
+
+# the backend transcription uses unless told otherwise, see configure()
+BACKEND = WHISPER
+
+# CPU threads each backend may use; 0 leaves it to the engine
+CPU_THREADS = 0
+
+# 1 decodes greedily, more runs a beam search of that width
+BEAM_SIZE = 1
+
+# faster-whisper's weight format on the CPU; int8 is about four times smaller than float32 and much faster
+COMPUTE_TYPE = "int8"
+
+WARM_UP_SECONDS = 1
+
+Audio = Union[str, np.ndarray]
+
+# one lock per loaded whisper model: its kv-cache hooks sit on the shared decoder modules,
+# so two decodes on the same model at once would overwrite each other's cache
+_MODEL_LOCKS: Dict[str, threading.Lock] = {}
+
+
+def configure(backend: str = WHISPER, cpu_threads: int = 0, beam_size: int = 1) -> None:
+    """
+    Sets the backend and decoding options used by transcribe() and get_backend().
+
+    Args:
+        backend (str, optional): WHISPER or FASTER_WHISPER. Default is WHISPER.
+        cpu_threads (int, optional): CPU threads for inference, or 0 for the engine's default. Default is 0.
+        beam_size (int, optional): 1 for greedy decoding, or the beam width. Default is 1.
+    """
+    global BACKEND, CPU_THREADS, BEAM_SIZE
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown ASR backend '{backend}', expected one of: {', '.join(BACKENDS)}")
+    BACKEND = backend
+    CPU_THREADS = cpu_threads
+    BEAM_SIZE = beam_size
+
+
+class WhisperBackend:
+    """
+    The reference whisper package, running in float32 on the CPU. Transcriptions on the same model
+    run one at a time.
+    """
+    name = WHISPER
+
+    # whether several threads can transcribe with one loaded model at the same time
+    concurrent = False
+
+    def __init__(self, whisper_model: str, cpu_threads: int = 0, beam_size: int = 1):
+        if cpu_threads:
+            import torch
+            torch.set_num_threads(cpu_threads)
+        self.whisper_model = whisper_model
+        self.beam_size = beam_size
+        self.model = model_registry.get_model(whisper_model)
+        self._lock = _MODEL_LOCKS.setdefault(whisper_model, threading.Lock())
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        return model_registry.MODEL_STATS[self.whisper_model]
+
+    def transcribe(self, audio: Audio, language: str, initial_prompt: Optional[str] = None) -> str:
+        # whisper's own default is greedy decoding with temperature fallback, so only pass a beam when asked for one
+        options: Dict[str, Any] = {"beam_size": self.beam_size} if self.beam_size > 1 else {}
+        with self._lock:
+            result = self.model.transcribe(audio, language=language, fp16=False, initial_prompt=initial_prompt, **options)
+        return result["text"]
+
+
+class FasterWhisperBackend:
+    """
+    The same whisper models through CTranslate2 (the faster-whisper package), with int8 weights on the CPU.
+    """
+    name = FASTER_WHISPER
+
+    concurrent = True
+
+    def __init__(self, whisper_model: str, cpu_threads: int = 0, beam_size: int = 1):
+        from faster_whisper import WhisperModel
+
+        rss_before = model_registry.resident_memory()
+        start = time.perf_counter()
+        self.model = WhisperModel(whisper_model, device="cpu", compute_type=COMPUTE_TYPE, cpu_threads=cpu_threads)
+        self.beam_size = beam_size
+        self.stats: Dict[str, float] = {
+            "load_seconds": time.perf_counter() - start,
+            "resident_bytes_delta": max(model_registry.resident_memory() - rss_before, 0),
+        }
+
+    def transcribe(self, audio: Audio, language: str, initial_prompt: Optional[str] = None) -> str:
+        segments, _ = self.model.transcribe(audio, language=language, beam_size=self.beam_size, initial_prompt=initial_prompt)
+        # segments are decoded lazily as they are iterated
+        return "".join(segment.text for segment in segments)
+
+
+BACKENDS: Dict[str, Type] = {WHISPER: WhisperBackend, FASTER_WHISPER: FasterWhisperBackend}
+
+# loaded backends, keyed by (backend, model, threads, beam size)
+LOADED: Dict[Tuple[str, str, int, int], Any] = {}
+
+_LOCK = threading.Lock()
+
+
+def get_backend(whisper_model: str, backend: Optional[str] = None, cpu_threads: Optional[int] = None, beam_size: Optional[int] = None) -> Any:
+    """
+    Returns the loaded backend for a model, loading it on first use. Options left out come from configure().
+    If faster-whisper isn't installed or can't load the model, the whisper backend is used instead.
+
+    Args:
+        whisper_model (str): The model size, e.g. 'base' or 'small.en'.
+        backend (Optional[str]): WHISPER or FASTER_WHISPER.
+        cpu_threads (Optional[int]): CPU threads for inference, or 0 for the engine's default.
+        beam_size (Optional[int]): 1 for greedy decoding, or the beam width.
+
+    Returns:
+        The backend, with a transcribe(audio, language, initial_prompt=None) method.
+    """
+    key = (backend or BACKEND, whisper_model, CPU_THREADS if cpu_threads is None else cpu_threads, BEAM_SIZE if beam_size is None else beam_size)
+    loaded = LOADED.get(key)
+    if loaded is not None:
+        return loaded
+
+    with _LOCK:
+        # another thread may have finished loading while we waited for the lock
+        if key in LOADED:
+            return LOADED[key]
+        name, _, threads, beam = key
+        try:
+            loaded = BACKENDS[name](whisper_model, threads, beam)
+        except Exception as e:
+            if name == WHISPER:
+                raise
+            print(f"Error loading the {name} backend, falling back to {WHISPER}: {e}")
+            loaded = WhisperBackend(whisper_model, threads, beam)
+        LOADED[key] = loaded
+        return loaded
+
+
+def transcribe(audio: Audio, whisper_model: str, language: str, initial_prompt: Optional[str] = None) -> str:
+    """
+    Transcribes audio with the configured backend, retrying with the whisper backend if another one fails.
+
+    Args:
+        audio (Union[str, np.ndarray]): The name of an audio file, or 16 kHz float32 samples.
+        whisper_model (str): The model size to be used.
+        language (str): The intended language of the audio.
+        initial_prompt (Optional[str]): Text that came before the audio, to keep the transcript consistent.
+
+    Returns:
+        str: The transcribed text.
+    """
+    backend = get_backend(whisper_model)
+    try:
+        return backend.transcribe(audio, language, initial_prompt)
+    except Exception as e:
+        if backend.name == WHISPER:
+            raise
+        print(f"Error transcribing with {backend.name}, falling back to {WHISPER}: {e}")
+        return get_backend(whisper_model, WHISPER).transcribe(audio, language, initial_prompt)
+
+
+def model_stats(whisper_model: str) -> Optional[Dict[str, float]]:
+    """
+    Returns the load time and memory figures of the configured backend's model, or None if it isn't loaded yet.
+    """
+    backend = LOADED.get((BACKEND, whisper_model, CPU_THREADS, BEAM_SIZE))
+    return None if backend is None else backend.stats
+
+
+def warm_up(whisper_model: str, background: bool = True) -> Optional[threading.Thread]:
+    """
+    Loads the configured backend's model and runs a short dummy decode so the first real
+    transcription doesn't pay for lazy initialization.
+
+    Args:
+        whisper_model (str): The model size to be used.
+        background (bool, optional): Whether to warm up on a daemon thread. Default is True.
+
+    Returns:
+        thread (Optional[threading.Thread]): The warm-up thread, or None if run in the foreground.
+    """
+    def run() -> None:
+        try:
+            backend = get_backend(whisper_model)
+            # 16 kHz is the sample rate every backend expects
+            silence = np.zeros(16000 * WARM_UP_SECONDS, dtype=np.float32)
+            start = time.perf_counter()
+            backend.transcribe(silence, "en")
+            backend.stats["warm_up_seconds"] = time.perf_counter() - start
+        except Exception as e:
+            print(f"Error warming up speech recognition model: {e}")
+
+    if not background:
+        run()
+        return None
+
+    thread = threading.Thread(target=run, name=f"asr-warm-up-{whisper_model}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac", ".ogg", ".webm")
+
+# clips up to whisper's 30 second window are decoded together in one batch; longer ones go through transcribe
+BATCH_SIZE = 8
+
+# concurrent edge_tts requests when synthesizing
+SYNTHESIS_CONCURRENCY = 8
+
+# synthesis caches its audio apart from the interactive cache, so bulk runs don't evict the interactive working set
+SYNTHESIS_CACHE_DIRECTORY = ".tts_cache_batch/"
+
+
+class Checkpoint:
+    """
+    The JSONL results file of a batch run, which also records what is already done so an
+    interrupted run picks up where it stopped. Each result is flushed as soon as it is written.
+    """
+    def __init__(self, path: str, key: str):
+        self.path = path
+        self.key = key
+        self.done: Set[str] = set()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line may have been cut off by the interruption
+                        continue
+                    if record.get("status") == "ok":
+                        self.done.add(record[key])
+        except FileNotFoundError:
+            pass
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if record.get("status") == "ok":
+            self.done.add(record[self.key])
+
+    def close(self) -> None:
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+def find_audio_files(directory: str) -> List[str]:
+    """
+    Returns every audio file under directory, recursively, in a stable order.
+    """
+    paths: List[str] = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+_WORKER_MODEL: Optional[str] = None
+_WORKER_LANGUAGE: Optional[str] = None
+
+
+def _init_worker(whisper_model: str, language: str, threads: int) -> None:
+    """
+    Loads the whisper model once in each worker process, splitting the CPU cores between the workers.
+    """
+    global _WORKER_MODEL, _WORKER_LANGUAGE
+    import torch
+    import model_registry
+
+    torch.set_num_threads(threads)
+    model_registry.get_model(whisper_model)
+    _WORKER_MODEL = whisper_model
+    _WORKER_LANGUAGE = language
+
+
+def _transcribe_batch(paths: List[str]) -> List[Dict[str, Any]]:
+    """
+    Transcribes a batch of files in a worker. Clips that fit in whisper's window are decoded together
+    as one batch of mel spectrograms; longer clips go through asr_backends one at a time.
+    """
+    import torch
+    import whisper
+    import asr_backends
+    import model_registry
+
+    model = model_registry.get_model(_WORKER_MODEL)
+    results: List[Dict[str, Any]] = []
+    short_clips: List[Dict[str, Any]] = []
+    mels = []
+    for path in paths:
+        start = time.perf_counter()
+        try:
+            audio = whisper.load_audio(path)
+        except Exception as e:
+            results.append({"path": path, "status": "error", "error": str(e)})
+            continue
+        seconds = audio.size / whisper.audio.SAMPLE_RATE
+        if audio.size <= whisper.audio.N_SAMPLES:
+            mels.append(whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), getattr(model.dims, "n_mels", 80)))
+            short_clips.append({"path": path, "audio_seconds": round(seconds, 3), "load_seconds": time.perf_counter() - start})
+            continue
+
+        try:
+            text = asr_backends.transcribe(audio, _WORKER_MODEL, _WORKER_LANGUAGE)
+        except Exception as e:
+            results.append({"path": path, "status": "error", "error": str(e)})
+        else:
+            results.append({"path": path, "status": "ok", "text": text.strip(), "audio_seconds": round(seconds, 3), "seconds": round(time.perf_counter() - start, 3)})
+
+    if short_clips:
+        start = time.perf_counter()
+        try:
+            options = whisper.DecodingOptions(language=_WORKER_LANGUAGE, fp16=False, without_timestamps=True)
+            decoded = whisper.decode(model, torch.stack(mels).to(model.device), options)
+        except Exception as e:
+            results.extend({"path": clip["path"], "status": "error", "error": str(e)} for clip in short_clips)
+            return results
+        # the batch's decode time is shared evenly between its clips
+        decode_seconds = (time.perf_counter() - start) / len(short_clips)
+        for clip, result in zip(short_clips, decoded):
+            results.append({
+                "path": clip["path"],
+                "status": "ok",
+                "text": result.text.strip(),
+                "audio_seconds": clip["audio_seconds"],
+                "seconds": round(clip["load_seconds"] + decode_seconds, 3),
+            })
+    return results
+
+
+def transcribe_directory(directory: str, output: str, whisper_model: str, language: str, workers: int, batch_size: int = BATCH_SIZE) -> None:
+    """
+    Transcribes every audio file in a directory with a pool of worker processes, each holding its
+    own copy of the model, and appends one JSON line per file to output as soon as it is done.
+    Files already transcribed in output are skipped, so an interrupted run can just be started again.
+
+    Args:
+        directory (str): The directory of audio files to transcribe.
+        output (str): The JSONL file results are appended to.
+        whisper_model (str): The whisper model to be used.
+        language (str): The language of the recordings.
+        workers (int): The number of worker processes.
+        batch_size (int, optional): How many files each worker decodes at once. Default is BATCH_SIZE.
+    """
+    checkpoint = Checkpoint(output, "path")
+    paths = [path for path in find_audio_files(directory) if path not in checkpoint.done]
+    print(f"{len(checkpoint.done)} file(s) already transcribed, {len(paths)} to go.")
+    if not paths:
+        checkpoint.close()
+        return
+
+    # each worker gets its share of the cores, so the pool doesn't oversubscribe the CPU
+    threads = max((os.cpu_count() or 1) // workers, 1)
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    finished = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(whisper_model, language, threads)) as pool:
+            futures = [pool.submit(_transcribe_batch, batch) for batch in batches]
+            for future in as_completed(futures):
+                for record in future.result():
+                    checkpoint.write(record)
+                    finished += 1
+                    if record["status"] != "ok":
+                        print(f"Error transcribing {record['path']}: {record['error']}")
+                print(f"Transcribed {finished}/{len(paths)} file(s).")
+    finally:
+        checkpoint.close()
+
+
+def read_lines(path: str) -> Iterator[Dict[str, str]]:
+    """
+    Reads the text lines to synthesize from a CSV file with a header row, or a JSONL file, with a
+    'text' column and optional 'id', 'language' and 'gender' columns. Lines without an id are
+    numbered in file order.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = (json.loads(line) for line in f if line.strip()) if path.lower().endswith(".jsonl") else csv.DictReader(f)
+        for number, row in enumerate(rows, start=1):
+            row = dict(row)
+            row["id"] = str(row.get("id") or number)
+            yield row
+
+
+def _write_atomically(path: str, data: bytes) -> None:
+    # write to a temporary file and rename it so an interruption never leaves a truncated file behind
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+async def synthesize_lines(lines_file: str, output_directory: str, output: str, language: str, gender: str, concurrency: int = SYNTHESIS_CONCURRENCY, cache_directory: str = SYNTHESIS_CACHE_DIRECTORY) -> None:
+    """
+    Synthesizes every line of a CSV or JSONL file to an MP3 named after its id, with at most
+    concurrency lines in flight, appending one JSON line per result to output as soon as it is done.
+    Lines already synthesized in output are skipped, so an interrupted run can just be started again.
+
+    Args:
+        lines_file (str): The CSV or JSONL file of lines, see read_lines.
+        output_directory (str): Where the MP3 files are written.
+        output (str): The JSONL file results are appended to.
+        language (str): The language of lines that don't give their own.
+        gender (str): The voice gender, 'M' or 'F', for lines that don't give their own.
+        concurrency (int, optional): The number of lines synthesized at once. Default is SYNTHESIS_CONCURRENCY.
+        cache_directory (str, optional): Where synthesized audio is cached. Default is SYNTHESIS_CACHE_DIRECTORY.
+    """
+    import generate_audio
+    import tts_cache
+
+    tts_cache.CACHE_DIRECTORY = cache_directory
+
+    os.makedirs(output_directory, exist_ok=True)
+    checkpoint = Checkpoint(output, "id")
+    lines = (line for line in read_lines(lines_file) if line["id"] not in checkpoint.done)
+    finished = 0
+
+    async def worker() -> None:
+        nonlocal finished
+        # the workers share one iterator, so there are never more than concurrency lines in flight
+        for line in lines:
+            path = os.path.join(output_directory, f"{line['id']}.mp3")
+            start = time.perf_counter()
+            try:
+                audio_file = await generate_audio.generate_audio(line["text"], line.get("language") or language, line.get("gender") or gender)
+                data = audio_file.getvalue()
+                _write_atomically(path, data)
+                record = {"id": line["id"], "status": "ok", "path": path, "bytes": len(data), "seconds": round(time.perf_counter() - start, 3)}
+            except Exception as e:
+                print(f"Error synthesizing line {line['id']}: {e}")
+                record = {"id": line["id"], "status": "error", "error": str(e)}
+            checkpoint.write(record)
+            finished += 1
+            if finished % 50 == 0:
+                print(f"Synthesized {finished} line(s).")
+
+    print(f"{len(checkpoint.done)} line(s) already synthesized.")
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        checkpoint.close()
+    print(f"Synthesized {finished} line(s).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Transcribe recordings or pre-render speech in bulk, outside the interactive loop.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    transcribe_parser = subparsers.add_parser('transcribe', help='Transcribe a directory of audio files.')
+    transcribe_parser.add_argument('directory', type=str, help='The directory of recordings.')
+    transcribe_parser.add_argument('output', type=str, help='The JSONL file to write results to; rerunning with the same file resumes the run.')
+    transcribe_parser.add_argument('--whisper-model', type=str, default='base', help='Whisper model to be used.', choices=["tiny", "tiny.en", "base", "base.en", "small", "small.en"])
+    transcribe_parser.add_argument('--language', type=str, default='en', help='The language code of the recordings.')
+    transcribe_parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 1) // 2, 1), help='Worker processes, each with its own copy of the model.')
+    transcribe_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Clips of up to 30 seconds decoded together by a worker.')
+
+    synthesize_parser = subparsers.add_parser('synthesize', help='Render a CSV or JSONL file of lines to MP3 files.')
+    synthesize_parser.add_argument('lines', type=str, help="A CSV (with a header row) or JSONL file with a 'text' column and optional 'id', 'language' and 'gender'.")
+    synthesize_parser.add_argument('output_directory', type=str, help='Where to write the MP3 files, named after each line id.')
+    synthesize_parser.add_argument('output', type=str, help='The JSONL file to write results to; rerunning with the same file resumes the run.')
+    synthesize_parser.add_argument('--language', type=str, default='en', help='The language of lines that do not give one.')
+    synthesize_parser.add_argument('--gender', type=str, default='M', choices=["M", "F"], help='The voice gender for lines that do not give one.')
+    synthesize_parser.add_argument('--concurrency', type=int, default=SYNTHESIS_CONCURRENCY, help='Lines synthesized at once.')
+    synthesize_parser.add_argument('--tts-cache', type=str, default=SYNTHESIS_CACHE_DIRECTORY, help='Where to cache synthesized audio; pass .tts_cache/ to pre-warm the interactive cache instead.')
+
+    args = parser.parse_args()
+    if args.command == 'transcribe':
+        transcribe_directory(args.directory, args.output, args.whisper_model, args.language, args.workers, args.batch_size)
+    else:
+        asyncio.run(synthesize_lines(args.lines, args.output_directory, args.output, args.language, args.gender, args.concurrency, args.tts_cache))
@@ -0,0 +1,104 @@
+import argparse
+import os
+import re
+import tempfile
+import time
+import numpy as np
+from bench import fixtures
+from typing import Dict, List, Optional
+
+
+def normalize(text: str) -> List[str]:
+    """
+    Lowercases a transcript and drops punctuation, so only word choice counts towards the error rate.
+    """
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_errors(reference: List[str], hypothesis: List[str]) -> int:
+    """
+    Returns the word-level edit distance (substitutions, insertions and deletions) between two transcripts.
+    """
+    previous = list(range(len(hypothesis) + 1))
+    for i, reference_word in enumerate(reference, start=1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hypothesis_word in enumerate(hypothesis, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (reference_word != hypothesis_word))
+        previous = current
+    return previous[-1]
+
+
+def load_references(names: List[str]) -> Dict[str, str]:
+    """
+    Returns the reference transcript of every fixture that has one, from a .txt file next to its .wav.
+    """
+    references: Dict[str, str] = {}
+    for name in names:
+        path = os.path.join(fixtures.FIXTURE_DIRECTORY, name + ".txt")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                references[name] = f.read()
+    return references
+
+
+def benchmark(whisper_model: str, backend: str, cpu_threads: int, beam_size: int, clips: Dict[str, np.ndarray], references: Dict[str, str], language: str) -> Dict[str, Optional[float]]:
+    """
+    Transcribes every clip with one backend configuration.
+
+    Returns:
+        The backend actually used (after any fallback), its real-time factor (seconds of processing per
+        second of audio, lower is faster), and its word error rate over the clips with references.
+    """
+    import asr_backends
+
+    loaded = asr_backends.get_backend(whisper_model, backend, cpu_threads, beam_size)
+    # the first decode pays for lazy initialization, which isn't what is being compared
+    loaded.transcribe(next(iter(clips.values())), language)
+
+    processing_seconds = 0.0
+    errors = 0
+    reference_words = 0
+    for name, samples in clips.items():
+        start = time.perf_counter()
+        text = loaded.transcribe(samples, language)
+        processing_seconds += time.perf_counter() - start
+        if name in references:
+            reference = normalize(references[name])
+            errors += word_errors(reference, normalize(text))
+            reference_words += len(reference)
+
+    audio_seconds = sum(samples.size for samples in clips.values()) / fixtures.RATE
+    return {
+        "backend": loaded.name,
+        "rtf": processing_seconds / audio_seconds,
+        "wer": errors / reference_words if reference_words else None,
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory(prefix="lingo-asr-bench-") as workdir:
+        pcm = fixtures.load(os.path.join(workdir, "fixtures"))
+    clips = {name: np.frombuffer(data, np.int16).astype(np.float32) / 32768.0 for name, data in pcm.items()}
+    references = load_references(list(clips))
+    audio_seconds = sum(samples.size for samples in clips.values()) / fixtures.RATE
+    print(f"{len(clips)} fixture(s), {audio_seconds:.1f}s of audio, {len(references)} with reference transcripts.")
+    if not references:
+        print(f"Add a .txt transcript next to each .wav in {fixtures.FIXTURE_DIRECTORY} to measure word error rate.")
+
+    print(f"\n{'backend':<16}  {'threads':>7}  {'beam':>4}  {'RTF':>6}  {'WER':>6}")
+    for backend in args.backends.split(","):
+        for cpu_threads in args.threads:
+            for beam_size in args.beam_sizes:
+                result = benchmark(args.whisper_model, backend, cpu_threads, beam_size, clips, references, args.language)
+                wer = "n/a" if result["wer"] is None else f"{result['wer']:.1%}"
+                print(f"{result['backend']:<16}  {cpu_threads or 'auto':>7}  {beam_size:>4}  {result['rtf']:6.3f}  {wer:>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the speed (real-time factor) and accuracy (word error rate) of the ASR backends on the fixtures.')
+    parser.add_argument('--whisper-model', type=str, default='base', help='Model size to compare.', choices=["tiny", "tiny.en", "base", "base.en", "small", "small.en"])
+    parser.add_argument('--backends', type=str, default='whisper,faster-whisper', help='Comma separated backends to compare.')
+    parser.add_argument('--threads', type=int, nargs='+', default=[0], help='CPU thread counts to try (0 for the engine default).')
+    parser.add_argument('--beam-sizes', type=int, nargs='+', default=[1, 5], help='Beam widths to try; 1 decodes greedily.')
+    parser.add_argument('--language', type=str, default='en', help='The language of the fixtures.')
+    main(parser.parse_args())
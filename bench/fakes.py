@@ -0,0 +1,341 @@
+import asyncio
+import hashlib
+import json
+import math
+import threading
+import time
+import types
+import uuid
+from aiohttp import web
+from typing import Any, Dict, List, Optional
+
+# the fake chat model waits this long before its first token, then this long between tokens
+CHAT_FIRST_TOKEN_SECONDS = 0.3
+CHAT_TOKEN_SECONDS = 0.02
+
+# the fake TTS waits this long before its first chunk, then synthesizes at this many seconds per second of speech
+TTS_FIRST_CHUNK_SECONDS = 0.15
+TTS_SECONDS_PER_AUDIO_SECOND = 0.1
+
+# roughly how fast the voices speak, used to size the fake speech
+SPEECH_CHARS_PER_SECOND = 15
+
+# one silent MPEG-2 layer III frame: 24 kHz mono at 48 kbit/s, 144 bytes, 576 samples (24 ms)
+SILENT_MP3_FRAME = b"\xff\xf3\x64\xc0" + b"\x00" * 140
+MP3_FRAME_SECONDS = 576 / 24000
+FRAMES_PER_CHUNK = 20
+
+# the microphone and speaker run at this multiple of real time; 0 means as fast as possible
+MICROPHONE_SPEED = 1.0
+SPEAKER_SPEED = 0.0
+
+REPLY_SENTENCES = [
+    "That is a really good question.",
+    "Let me explain it in a simple way.",
+    "When we talk about the weather, we often use the word sunny.",
+    "Can you tell me what the weather is like where you live?",
+    "Try to answer with a whole sentence.",
+    "You are doing a great job, keep practicing!",
+]
+
+
+def reply_words(max_tokens: int, number: int) -> List[str]:
+    """
+    Returns the words of the fake model's reply, about three words for every four tokens allowed.
+    Every sentence carries the request number, so replies don't hit the speech cache the way
+    endlessly repeated sentences would.
+    """
+    word_count = max(max_tokens * 3 // 4, 1)
+    words: List[str] = []
+    sentence = number
+    while len(words) < word_count:
+        text = REPLY_SENTENCES[sentence % len(REPLY_SENTENCES)]
+        words.extend(f"{text[:-1]}, round {number}{text[-1]}".split())
+        sentence += 1
+    return words[:word_count]
+
+
+class FakeChatServer:
+    """
+    A local stand-in for the OpenAI chat completions endpoint, with configurable latency and SSE streaming.
+    It runs on its own event loop thread so the app's clients talk to it over real sockets.
+    """
+    def __init__(self):
+        self.requests = 0
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="fake-chat-server", daemon=True)
+        self._thread.start()
+        self.port: int = asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def _start(self) -> int:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        return self._runner.addresses[0][1]
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        words = reply_words(body.get("max_tokens") or 100, self.requests)
+        completion_id = "chatcmpl-" + uuid.uuid4().hex
+        await asyncio.sleep(CHAT_FIRST_TOKEN_SECONDS)
+
+        if not body.get("stream"):
+            await asyncio.sleep(CHAT_TOKEN_SECONDS * (len(words) - 1))
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(CHAT_TOKEN_SECONDS)
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class _Communicate:
+    def __init__(self, text: str, voice: str, **settings: str):
+        self.text = text
+        self.voice = voice
+
+    async def stream(self):
+        frame_count = max(math.ceil(len(self.text) / SPEECH_CHARS_PER_SECOND / MP3_FRAME_SECONDS), 1)
+        await asyncio.sleep(TTS_FIRST_CHUNK_SECONDS)
+        for start in range(0, frame_count, FRAMES_PER_CHUNK):
+            frames = min(FRAMES_PER_CHUNK, frame_count - start)
+            if start:
+                await asyncio.sleep(frames * MP3_FRAME_SECONDS * TTS_SECONDS_PER_AUDIO_SECOND)
+            yield {"type": "audio", "data": SILENT_MP3_FRAME * frames}
+        yield {"type": "WordBoundary", "offset": 0, "duration": 0, "text": self.text}
+
+
+async def _list_voices() -> List[Dict[str, str]]:
+    return [
+        {"ShortName": "en-US-BenchNeural", "Locale": "en-US", "Gender": "Male"},
+        {"ShortName": "en-US-BenchFemaleNeural", "Locale": "en-US", "Gender": "Female"},
+    ]
+
+
+def edge_tts_module() -> types.ModuleType:
+    """
+    Returns a stand-in for the edge_tts module that streams silent MP3 frames, about as long as the text would take to say.
+    """
+    module = types.ModuleType("edge_tts")
+    module.Communicate = _Communicate
+    module.list_voices = _list_voices
+    return module
+
+
+class Microphone:
+    """
+    Plays a PCM fixture into the fake input stream, followed by silence, at MICROPHONE_SPEED times real time.
+    """
+    def __init__(self):
+        self.pcm = b""
+        self.position = 0
+        self.started_at: Optional[float] = None
+        self.speech_ended_at: Optional[float] = None
+
+    def play(self, pcm: bytes) -> None:
+        self.pcm = pcm
+        self.position = 0
+        self.started_at = None
+        self.speech_ended_at = None
+
+    def read(self, frames: int, rate: int) -> bytes:
+        size = frames * 2
+        now = time.perf_counter()
+        if self.started_at is None:
+            self.started_at = now
+        if MICROPHONE_SPEED > 0:
+            # hand the chunk over once it would have been spoken
+            ready_at = self.started_at + (self.position + size) / 2 / rate / MICROPHONE_SPEED
+            if ready_at > now:
+                time.sleep(ready_at - now)
+        data = self.pcm[self.position:self.position + size]
+        self.position += size
+        if self.speech_ended_at is None and self.position >= len(self.pcm):
+            self.speech_ended_at = time.perf_counter()
+        return data + b"\x00" * (size - len(data))
+
+
+class Speaker:
+    """
+    Swallows the PCM written to the fake output stream, noting when the first audio of a turn arrived.
+    """
+    def __init__(self):
+        self.bytes_written = 0
+        self.first_write_at: Optional[float] = None
+
+    def mark(self) -> None:
+        self.first_write_at = None
+
+    def write(self, pcm: bytes, rate: int) -> None:
+        if self.first_write_at is None and pcm:
+            self.first_write_at = time.perf_counter()
+        self.bytes_written += len(pcm)
+        if SPEAKER_SPEED > 0:
+            time.sleep(len(pcm) / 2 / rate / SPEAKER_SPEED)
+
+
+MICROPHONE = Microphone()
+SPEAKER = Speaker()
+
+
+class _Stream:
+    def __init__(self, rate: int, frames_per_buffer: int):
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+
+    def read(self, frames: int, exception_on_overflow: bool = True) -> bytes:
+        return MICROPHONE.read(frames, self.rate)
+
+    def write(self, pcm: bytes) -> None:
+        SPEAKER.write(pcm, self.rate)
+
+    def stop_stream(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _PyAudio:
+    def get_sample_size(self, format: int) -> int:
+        return 2
+
+    def open(self, format: int, channels: int, rate: int, input: bool = False, output: bool = False, frames_per_buffer: int = 1024) -> _Stream:
+        return _Stream(rate, frames_per_buffer)
+
+    def terminate(self) -> None:
+        pass
+
+
+def pyaudio_module() -> types.ModuleType:
+    """
+    Returns a stand-in for the pyaudio module whose input streams read from MICROPHONE and output streams write to SPEAKER.
+    """
+    module = types.ModuleType("pyaudio")
+    module.paInt16 = 8
+    module.PyAudio = _PyAudio
+    module.Stream = _Stream
+    return module
+
+
+EMBEDDING_DIMENSIONS = 64
+
+
+def _embed(texts: List[str]) -> List[List[float]]:
+    # hashed bag of words, normalized, so related conversations land near each other without a model
+    embeddings = []
+    for text in texts:
+        vector = [0.0] * EMBEDDING_DIMENSIONS
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % EMBEDDING_DIMENSIONS] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        embeddings.append([v / norm for v in vector])
+    return embeddings
+
+
+def _as_list(value: Any) -> List[Any]:
+    return value if isinstance(value, list) else [value]
+
+
+class MemoryCollection:
+    """
+    An in-memory stand-in for the chromadb collection, supporting the calls database.py makes.
+    """
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+    def count(self) -> int:
+        return len(self.entries)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, include: Optional[List[str]] = None) -> Dict[str, List[Any]]:
+        selected = [i for i in (self.entries if ids is None else ids) if i in self.entries and self._matches(self.entries[i]["metadata"], where)]
+        return {
+            "ids": selected,
+            "documents": [self.entries[i]["document"] for i in selected],
+            "metadatas": [self.entries[i]["metadata"] for i in selected],
+        }
+
+    def add(self, documents: Any, metadatas: Any, ids: Any, embeddings: Optional[List[List[float]]] = None) -> None:
+        documents, metadatas, ids = _as_list(documents), _as_list(metadatas), _as_list(ids)
+        embeddings = embeddings or _embed(documents)
+        for document, metadata, id, embedding in zip(documents, metadatas, ids, embeddings):
+            self.entries[id] = {"document": document, "metadata": metadata, "embedding": embedding}
+
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        for id, metadata in zip(ids, metadatas):
+            self.entries[id]["metadata"] = metadata
+
+    def delete(self, ids: List[str]) -> None:
+        for id in ids:
+            self.entries.pop(id, None)
+
+    @staticmethod
+    def _matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+        return all(metadata.get(key) == value for key, value in (where or {}).items())
+
+    def query(self, query_embeddings: List[List[float]], n_results: int, where: Optional[Dict[str, Any]] = None, include: Optional[List[str]] = None) -> Dict[str, List[List[Any]]]:
+        if where and not any(self._matches(entry["metadata"], where) for entry in self.entries.values()):
+            # chromadb 0.3 raises rather than returning nothing when a filter matches no memories
+            from chromadb.errors import NoDatapointsException
+            raise NoDatapointsException(f"No datapoints found for the supplied filter {json.dumps(where)}")
+        results: Dict[str, List[List[Any]]] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query in query_embeddings:
+            scored = sorted(
+                (sum((a - b) ** 2 for a, b in zip(query, entry["embedding"])), id)
+                for id, entry in self.entries.items() if self._matches(entry["metadata"], where)
+            )[:n_results]
+            results["ids"].append([id for _, id in scored])
+            results["documents"].append([self.entries[id]["document"] for _, id in scored])
+            results["metadatas"].append([self.entries[id]["metadata"] for _, id in scored])
+            results["distances"].append([distance for distance, _ in scored])
+        return results
+
+
+class MemoryClient:
+    def persist(self) -> None:
+        pass
+
+
+def install_memory(database: types.ModuleType) -> None:
+    """
+    Points database at an in-memory collection instead of opening the chromadb store on disk.
+    """
+    def initialize_memory() -> None:
+        database.CLIENT = MemoryClient()
+        database.COLLECTION = MemoryCollection()
+        database.EMBEDDING_FUNCTION = _embed
+        database.COLLECTION_SIZE = 0
+
+    database.initialize_memory = initialize_memory
+    initialize_memory()
@@ -0,0 +1,75 @@
+import glob
+import math
+import os
+import random
+import struct
+import wave
+from typing import Dict
+
+# recordings dropped in here (16 kHz, 16-bit, mono WAV) are used in place of the generated ones
+FIXTURE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+RATE = 16000
+
+# name -> seconds of speech in each generated fixture
+GENERATED_FIXTURES = {"short": 2.0, "medium": 6.0, "long": 15.0}
+
+LEAD_IN_SECONDS = 0.3
+
+
+def _speech_like(seconds: float, seed: int) -> bytes:
+    """
+    Returns voiced-sounding 16-bit PCM: a few harmonics of a wandering pitch, chopped into syllables
+    with short pauses between words. It is loud enough for the endpointer; whisper won't find words in it.
+    """
+    random_ = random.Random(seed)
+    samples = [0] * int(LEAD_IN_SECONDS * RATE)
+    phase = 0.0
+    while len(samples) < (LEAD_IN_SECONDS + seconds) * RATE:
+        syllables = random_.randint(1, 3)
+        for _ in range(syllables):
+            length = int(random_.uniform(0.12, 0.25) * RATE)
+            pitch = random_.uniform(110, 200)
+            for i in range(length):
+                envelope = math.sin(math.pi * i / length)
+                phase += 2 * math.pi * pitch / RATE
+                value = sum(math.sin(phase * h) / h for h in (1, 2, 3, 4))
+                samples.append(int(6000 * envelope * value / 2.1))
+        samples.extend([0] * int(random_.uniform(0.08, 0.3) * RATE))
+    return struct.pack(f"<{len(samples)}h", *samples)
+
+
+def read_wav(path: str) -> bytes:
+    with wave.open(path, "rb") as wf:
+        if wf.getframerate() != RATE or wf.getnchannels() != 1 or wf.getsampwidth() != 2:
+            raise ValueError(f"{path} must be a 16 kHz, 16-bit, mono WAV file")
+        return wf.readframes(wf.getnframes())
+
+
+def write_wav(path: str, pcm: bytes) -> None:
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes(pcm)
+
+
+def load(directory: str) -> Dict[str, bytes]:
+    """
+    Returns the PCM of every fixture by name. Recordings in FIXTURE_DIRECTORY are used if there are any;
+    otherwise speech-like clips are generated into directory.
+
+    Args:
+        directory (str): Where to write the generated fixtures.
+
+    Returns:
+        Dict[str, bytes]: 16 kHz 16-bit mono PCM by fixture name.
+    """
+    paths = sorted(glob.glob(os.path.join(FIXTURE_DIRECTORY, "*.wav")))
+    if not paths:
+        os.makedirs(directory, exist_ok=True)
+        for seed, (name, seconds) in enumerate(GENERATED_FIXTURES.items()):
+            path = os.path.join(directory, name + ".wav")
+            write_wav(path, _speech_like(seconds, seed))
+            paths.append(path)
+    return {os.path.splitext(os.path.basename(path))[0]: read_wav(path) for path in paths}
@@ -0,0 +1,392 @@
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import model_registry
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from bench import fakes, fixtures
+from typing import Dict, Iterator, List, Optional, Tuple
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# how far a metric may move past its baseline before the run fails
+DEFAULT_TOLERANCE = 0.25
+
+# metrics where a bigger number is better; everything else is a latency or a size
+HIGHER_IS_BETTER = {"concurrent.turns_per_second"}
+
+# absolute leeway on top of the tolerance, for metrics whose baseline can sit near zero
+SLACK = {"memory.traced_kib_per_turn": 2.0, "memory.rss_growth_mib": 8.0}
+
+QUESTIONS = [
+    "How do I say good morning?",
+    "What did we talk about last time?",
+    "Can you help me describe the weather today?",
+    "What is the difference between big and large?",
+    "Tell me a short story about a cat.",
+]
+
+Results = Dict[str, float]
+Stages = Dict[str, Dict[str, float]]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def _resident_megabytes() -> float:
+    # the current size, not the peak, so memory freed between turns doesn't count as growth
+    return model_registry.resident_memory() / 2**20
+
+
+@contextlib.contextmanager
+def quiet() -> Iterator[None]:
+    # the app prints the whole conversation; keep it out of the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def prepare(workdir: str) -> fakes.FakeChatServer:
+    """
+    Puts the stand-ins in place of the microphone, speaker, edge_tts, the OpenAI API and the memory store,
+    and points every on-disk cache at workdir. Must run before the app's modules are imported.
+    """
+    sys.modules["pyaudio"] = fakes.pyaudio_module()
+    sys.modules["edge_tts"] = fakes.edge_tts_module()
+
+    chat_server = fakes.FakeChatServer()
+    # llm_client reads the key when it is imported
+    os.environ["LINGO_API_KEY"] = "bench"
+    import openai
+    openai.api_base = chat_server.url
+
+    import archiver
+    import database
+    import memory_maintenance
+    import tracing
+    import tts_cache
+    import voice_catalog
+    tts_cache.CACHE_DIRECTORY = os.path.join(workdir, "tts_cache")
+    archiver.JOURNAL_FILE = os.path.join(workdir, "archive_journal.jsonl")
+    memory_maintenance.MIGRATION_MARKER_FILE = os.path.join(workdir, "maintenance_migration")
+    voice_catalog.SNAPSHOT_FILE = os.path.join(workdir, "voices.json")
+    fakes.install_memory(database)
+    tracing.enable()
+    return chat_server
+
+
+def run_text(turns: int, stream_reply: bool) -> Tuple[Results, Stages]:
+    """
+    Typed turns through main.process_text_question, timing the whole turn and the wait for its first audio.
+    """
+    import main
+    import tracing
+
+    name = "text_stream" if stream_reply else "text"
+    tracing.reset()
+    turn_seconds: List[float] = []
+    first_audio_seconds: List[float] = []
+    for i in range(turns):
+        fakes.SPEAKER.mark()
+        start = time.perf_counter()
+        with quiet():
+            main.process_text_question(QUESTIONS[i % len(QUESTIONS)], "en", "M", "3", stream_reply)
+        turn_seconds.append(time.perf_counter() - start)
+        if fakes.SPEAKER.first_write_at is not None:
+            first_audio_seconds.append(fakes.SPEAKER.first_write_at - start)
+
+    return {
+        f"{name}.turn_p50": percentile(turn_seconds, 0.5),
+        f"{name}.turn_p95": percentile(turn_seconds, 0.95),
+        f"{name}.first_audio_p50": percentile(first_audio_seconds, 0.5),
+        f"{name}.first_audio_p95": percentile(first_audio_seconds, 0.95),
+    }, tracing.summary()
+
+
+def run_voice(turns: int, whisper_model: str, clips: Dict[str, bytes]) -> Tuple[Results, Stages]:
+    """
+    Spoken turns through main.process_voice_question with streaming transcription and a streamed reply,
+    timing from the end of the fixture's speech to the first audio of the reply.
+    """
+    try:
+        import whisper
+    except ImportError:
+        print("Skipping the voice scenario: whisper is not installed.")
+        return {}, {}
+    import asr_backends
+    import main
+    import tracing
+
+    # loading the model is startup, not part of a turn
+    asr_backends.warm_up(whisper_model, background=False)
+
+    tracing.reset()
+    turn_seconds: List[float] = []
+    response_seconds: List[float] = []
+    unanswered = 0
+    names = sorted(clips)
+    for i in range(turns):
+        fakes.MICROPHONE.play(clips[names[i % len(names)]])
+        fakes.SPEAKER.mark()
+        start = time.perf_counter()
+        with quiet():
+            main.process_voice_question(whisper_model, "en", "M", "3", streaming=True, stream_reply=True)
+        turn_seconds.append(time.perf_counter() - start)
+        if fakes.SPEAKER.first_write_at is None or fakes.MICROPHONE.speech_ended_at is None:
+            unanswered += 1
+        else:
+            response_seconds.append(fakes.SPEAKER.first_write_at - fakes.MICROPHONE.speech_ended_at)
+
+    if unanswered:
+        print(f"{unanswered} of {turns} voice turns got no reply; whisper found no words in their fixtures. "
+              f"Put recordings of speech in {fixtures.FIXTURE_DIRECTORY} to measure the whole turn.")
+    results = {"voice.turn_p50": percentile(turn_seconds, 0.5), "voice.turn_p95": percentile(turn_seconds, 0.95)}
+    if response_seconds:
+        results["voice.response_p50"] = percentile(response_seconds, 0.5)
+        results["voice.response_p95"] = percentile(response_seconds, 0.95)
+    return results, tracing.summary()
+
+
+async def _run_concurrent(whisper_model: str, sessions: int, turns: int) -> Tuple[List[float], List[float], float]:
+    import aiohttp
+    import database
+    import server
+    from aiohttp import web
+
+    runner = web.AppRunner(server.LingoServer(whisper_model).app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+    # another learner's memory, so every new learner's first lookup filters down to nothing
+    database.store_summaries(["I talked with another learner about their dog."], [{"name": "Other", database.LEARNER_KEY: "bench-other", "level": "summary", "timestamp": time.time()}], [uuid.uuid4().hex])
+
+    first_audio_seconds: List[float] = []
+    turn_seconds: List[float] = []
+    errors: List[str] = []
+
+    async def learner(index: int) -> None:
+        async with aiohttp.ClientSession() as http:
+            async with http.post(f"{url}/sessions", json={"name": f"Learner {index}", "language": "en", "gender": "M", "grade_level": "3"}) as response:
+                session_id = (await response.json())["id"]
+            async with http.ws_connect(f"{url}/sessions/{session_id}/ws") as ws:
+                for turn in range(turns):
+                    start = time.perf_counter()
+                    first_audio: Optional[float] = None
+                    await ws.send_json({"text": QUESTIONS[(index + turn) % len(QUESTIONS)]})
+                    async for message in ws:
+                        if message.type == aiohttp.WSMsgType.BINARY:
+                            if first_audio is None:
+                                first_audio = time.perf_counter() - start
+                        elif message.json()["type"] == "error":
+                            errors.append(message.json()["message"])
+                            break
+                        elif message.json()["type"] == "done":
+                            break
+                    turn_seconds.append(time.perf_counter() - start)
+                    if first_audio is not None:
+                        first_audio_seconds.append(first_audio)
+            await http.delete(f"{url}/sessions/{session_id}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(learner(i) for i in range(sessions)))
+    wall_seconds = time.perf_counter() - start
+    await runner.cleanup()
+    if errors:
+        raise RuntimeError(f"{len(errors)} turn(s) failed, e.g. {errors[0]}")
+    return turn_seconds, first_audio_seconds, wall_seconds
+
+
+def run_concurrent(whisper_model: str, sessions: int, turns: int) -> Tuple[Results, Stages]:
+    """
+    Many learners talking at once through the server, each over its own websocket.
+    """
+    import tracing
+
+    tracing.reset()
+    with quiet():
+        turn_seconds, first_audio_seconds, wall_seconds = asyncio.run(_run_concurrent(whisper_model, sessions, turns))
+    return {
+        "concurrent.turns_per_second": len(turn_seconds) / wall_seconds,
+        "concurrent.turn_p95": percentile(turn_seconds, 0.95),
+        "concurrent.first_audio_p50": percentile(first_audio_seconds, 0.5),
+        "concurrent.first_audio_p95": percentile(first_audio_seconds, 0.95),
+    }, tracing.summary()
+
+
+def run_memory(turns: int) -> Tuple[Results, Stages]:
+    """
+    A long conversation, measuring how much memory stays allocated per turn once the caches have warmed up.
+    """
+    import main
+    import tracing
+
+    tracing.reset()
+    warm_up_turns = max(turns // 5, 1)
+    tracemalloc.start()
+    traced_start = 0
+    rss_start = 0.0
+    for i in range(turns):
+        if i == warm_up_turns:
+            gc.collect()
+            traced_start = tracemalloc.get_traced_memory()[0]
+            rss_start = _resident_megabytes()
+        with quiet():
+            main.process_text_question(QUESTIONS[i % len(QUESTIONS)], "en", "M", "3", stream_reply=True)
+    gc.collect()
+    traced_end = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {
+        "memory.traced_kib_per_turn": (traced_end - traced_start) / 1024 / (turns - warm_up_turns),
+        "memory.rss_growth_mib": _resident_megabytes() - rss_start,
+    }, tracing.summary()
+
+
+def compare(results: Results, baselines: Results, tolerance: float) -> List[str]:
+    """
+    Prints every metric next to its baseline and returns the names of the ones that regressed.
+    """
+    regressions: List[str] = []
+    width = max(len(name) for name in results)
+    print(f"\n{'metric'.ljust(width)}  {'result':>10}  {'baseline':>10}  status")
+    for name, value in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            status = "no baseline"
+        else:
+            slack = SLACK.get(name, 0.0)
+            if name in HIGHER_IS_BETTER:
+                regressed = value < baseline * (1 - tolerance) - slack
+            else:
+                regressed = value > baseline * (1 + tolerance) + slack
+            status = "REGRESSED" if regressed else "ok"
+            if regressed:
+                regressions.append(name)
+        baseline_text = "" if baseline is None else f"{baseline:10.4f}"
+        print(f"{name.ljust(width)}  {value:10.4f}  {baseline_text:>10}  {status}")
+    return regressions
+
+
+def print_stages(scenario: str, stages: Stages) -> None:
+    if not stages:
+        return
+    width = max(len(name) for name in stages)
+    print(f"\n{scenario}: per-stage latency (ms)")
+    print(f"{'stage'.ljust(width)}  {'count':>6}  {'p50':>8}  {'p95':>8}  {'p99':>8}")
+    for name, stage in sorted(stages.items()):
+        print(f"{name.ljust(width)}  {stage['count']:6d}  {stage['p50'] * 1000:8.1f}  {stage['p95'] * 1000:8.1f}  {stage['p99'] * 1000:8.1f}")
+
+
+def main(args: argparse.Namespace) -> int:
+    fakes.CHAT_FIRST_TOKEN_SECONDS = args.chat_first_token_ms / 1000
+    fakes.CHAT_TOKEN_SECONDS = args.chat_token_ms / 1000
+    fakes.TTS_FIRST_CHUNK_SECONDS = args.tts_first_chunk_ms / 1000
+    fakes.MICROPHONE_SPEED = args.microphone_speed
+    settings = {
+        "chat_first_token_ms": args.chat_first_token_ms,
+        "chat_token_ms": args.chat_token_ms,
+        "tts_first_chunk_ms": args.tts_first_chunk_ms,
+        "microphone_speed": args.microphone_speed,
+        "turns": args.turns,
+        "sessions": args.sessions,
+        "long_turns": args.long_turns,
+    }
+
+    results: Results = {}
+    with tempfile.TemporaryDirectory(prefix="lingo-bench-") as workdir:
+        chat_server = prepare(workdir)
+        clips = fixtures.load(os.path.join(workdir, "fixtures"))
+        scenarios = args.scenarios.split(",")
+        try:
+            for scenario in scenarios:
+                if scenario == "text":
+                    scenario_results, stages = run_text(args.turns, stream_reply=False)
+                elif scenario == "text_stream":
+                    scenario_results, stages = run_text(args.turns, stream_reply=True)
+                elif scenario == "voice":
+                    scenario_results, stages = run_voice(args.turns, args.whisper_model, clips)
+                elif scenario == "concurrent":
+                    scenario_results, stages = run_concurrent(args.whisper_model, args.sessions, args.turns)
+                elif scenario == "memory":
+                    scenario_results, stages = run_memory(args.long_turns)
+                else:
+                    raise ValueError(f"Unknown scenario '{scenario}'")
+                results.update(scenario_results)
+                print_stages(scenario, stages)
+        finally:
+            import archiver
+            with quiet():
+                archiver.stop()
+            chat_server.stop()
+
+    if not results:
+        print("Nothing was measured.")
+        return 1
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "metrics": results}, f, indent=2)
+
+    if args.update_baselines:
+        tolerance = DEFAULT_TOLERANCE if args.tolerance is None else args.tolerance
+        with open(args.baselines, "w", encoding="utf-8") as f:
+            json.dump({"tolerance": tolerance, "settings": settings, "metrics": {name: round(value, 6) for name, value in results.items()}}, f, indent=2)
+            f.write("\n")
+        compare(results, {}, tolerance)
+        print(f"\nBaselines written to {args.baselines}.")
+        return 0
+
+    try:
+        with open(args.baselines, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+    except FileNotFoundError:
+        stored = {"metrics": {}}
+    tolerance = stored.get("tolerance", DEFAULT_TOLERANCE) if args.tolerance is None else args.tolerance
+    if stored.get("settings", settings) != settings:
+        # a run that can't be compared can't pass the gate either
+        print(f"\nThe baselines in {args.baselines} were recorded with different settings ({stored['settings']}); not comparing.")
+        compare(results, {}, tolerance)
+        return 1
+
+    baselines = stored.get("metrics", {})
+    if not baselines:
+        # until baselines are recorded on a reference machine there is nothing to gate on
+        compare(results, {}, tolerance)
+        print(f"\nNo baselines are recorded in {args.baselines} yet; reporting only. Record them on a reference machine with --update-baselines.")
+        return 0
+    regressions = compare(results, baselines, tolerance)
+    missing = [name for name in results if name not in baselines]
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed past their baselines: {', '.join(regressions)}")
+    if missing:
+        print(f"\n{len(missing)} metric(s) have no baseline: {', '.join(missing)}. Record them on a reference machine with --update-baselines.")
+    return 1 if regressions or missing else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the turn pipeline offline, against local stand-ins for OpenAI, edge-tts, the microphone and the speaker.')
+    parser.add_argument('--scenarios', type=str, default='text,text_stream,voice,concurrent,memory', help='Comma separated scenarios to run.')
+    parser.add_argument('--whisper-model', type=str, default='tiny', help='Whisper model for the voice scenario.')
+    parser.add_argument('--turns', type=int, default=10, help='Turns per scenario, and per session in the concurrent scenario.')
+    parser.add_argument('--sessions', type=int, default=16, help='Learners talking at once in the concurrent scenario.')
+    parser.add_argument('--long-turns', type=int, default=200, help='Turns in the memory growth scenario.')
+    parser.add_argument('--chat-first-token-ms', type=float, default=300, help='Latency of the fake chat model before its first token.')
+    parser.add_argument('--chat-token-ms', type=float, default=20, help='Latency of the fake chat model between tokens.')
+    parser.add_argument('--tts-first-chunk-ms', type=float, default=150, help='Latency of the fake TTS before its first chunk of audio.')
+    parser.add_argument('--microphone-speed', type=float, default=1.0, help='How many times faster than real time the fixtures are played into the microphone; 0 for no pacing.')
+    parser.add_argument('--baselines', type=str, default=BASELINE_FILE, help='Baselines to compare against.')
+    parser.add_argument('--tolerance', type=float, help=f'Fraction a metric may regress by before the run fails. Default is the tolerance stored with the baselines, or {DEFAULT_TOLERANCE}; with --update-baselines it is stored with them.')
+    parser.add_argument('--update-baselines', action='store_true', help='Store this run as the new baselines instead of comparing against them.')
+    parser.add_argument('--output', type=str, help='Also write the results to this JSON file.')
+    sys.exit(main(parser.parse_args()))
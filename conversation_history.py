@@ -0,0 +1,131 @@
+from typing import Dict, Iterator, List, Optional, Union
+
+# messages a history holds before the oldest are overwritten; generate_response.append_message
+# archives the oldest messages before that happens
+DEFAULT_CAPACITY = 20
+
+
+class Message:
+    """
+    One message of a conversation. The Chat API dict and the transcript line are built once, when
+    the message is added, and shared by every prompt and memory lookup that includes it.
+    """
+    __slots__ = ("role", "name", "content", "message", "line")
+
+    def __init__(self, message: Dict[str, str]):
+        self.role = message["role"]
+        self.name = message.get("name")
+        self.content = message["content"]
+        self.message = message
+        self.line = f"{self.name}: {self.content}"
+
+
+class ConversationHistory:
+    """
+    The recent messages of a conversation, oldest first, in a fixed-capacity ring buffer. Appending
+    and reading the newest messages don't depend on how long the conversation has been going, and
+    the formatted transcript is updated as messages come and go rather than rebuilt on every read.
+
+    Indexing, slicing and iterating give the Chat API message dicts, so it can be used wherever
+    a list of messages was.
+    """
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, messages: Optional[List[Dict[str, str]]] = None):
+        self.capacity = capacity
+        self._records: List[Optional[Message]] = [None] * capacity
+        self._start = 0
+        self._length = 0
+        self._text = ""
+        for message in messages or []:
+            self.append(message)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _record(self, index: int) -> Message:
+        return self._records[(self._start + index) % self.capacity]
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Dict[str, str], List[Dict[str, str]]]:
+        if isinstance(index, slice):
+            return [self._record(i).message for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("conversation history index out of range")
+        return self._record(index).message
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        for i in range(self._length):
+            yield self._record(i).message
+
+    def append(self, message: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """
+        Adds a message after the newest one.
+
+        Returns:
+            Optional[Dict[str, str]]: The oldest message if the history was full and it was overwritten, otherwise None.
+        """
+        evicted = self.popleft(1) if self._length == self.capacity else []
+        record = Message(message)
+        self._records[(self._start + self._length) % self.capacity] = record
+        self._length += 1
+        self._text = f"{self._text}\n{record.line}" if self._text else record.line
+        return evicted[0] if evicted else None
+
+    def popleft(self, count: int) -> List[Dict[str, str]]:
+        """
+        Removes up to count of the oldest messages and returns them, oldest first.
+        """
+        count = min(count, self._length)
+        removed = [self._record(i) for i in range(count)]
+        for i in range(count):
+            self._records[(self._start + i) % self.capacity] = None
+        self._start = (self._start + count) % self.capacity
+        self._length -= count
+        # each line is followed by a newline, except the newest
+        self._text = self._text[sum(len(record.line) + 1 for record in removed):] if self._length else ""
+        return [record.message for record in removed]
+
+    def pop(self) -> Dict[str, str]:
+        """
+        Removes the newest message and returns it.
+        """
+        if not self._length:
+            raise IndexError("pop from an empty conversation history")
+        self._length -= 1
+        index = (self._start + self._length) % self.capacity
+        record = self._records[index]
+        self._records[index] = None
+        self._text = self._text[:len(self._text) - len(record.line) - 1] if self._length else ""
+        return record.message
+
+    def clear(self) -> None:
+        self.popleft(self._length)
+
+    def window(self, count: int) -> List[Dict[str, str]]:
+        """
+        Returns the newest count messages, oldest first.
+        """
+        return self[max(self._length - count, 0):]
+
+    def formatted(self, count: Optional[int] = None) -> str:
+        """
+        Returns the conversation as a transcript, one "name: content" line per message, see database.format_conversation.
+
+        Args:
+            count (Optional[int]): Only format the newest count messages. Default is all of them.
+        """
+        if count is None or count >= self._length:
+            return self._text.strip()
+        return "\n".join(self._record(i).line for i in range(self._length - count, self._length)).strip()
+
+    def copy(self) -> "ConversationHistory":
+        """
+        Returns a snapshot of the history that later changes to either one don't affect.
+        """
+        snapshot = ConversationHistory.__new__(ConversationHistory)
+        snapshot.capacity = self.capacity
+        snapshot._records = list(self._records)
+        snapshot._start = self._start
+        snapshot._length = self._length
+        snapshot._text = self._text
+        return snapshot
@@ -1,30 +1,72 @@
-import chromadb
+import contextvars
 import datetime
 import pytz
+import threading
+import time
 import generate_response
-from chromadb.api.local import LocalAPI
-from chromadb.api.models.Collection import Collection
-from chromadb.config import Settings
-from typing import List, Dict
+import tracing
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from conversation_history import ConversationHistory
+from typing import TYPE_CHECKING, Any, Callable, List, Dict, Optional, Tuple, Union
 
-CLIENT: LocalAPI = None
-COLLECTION: Collection = None
+if TYPE_CHECKING:
+    from chromadb.api.local import LocalAPI
+    from chromadb.api.models.Collection import Collection
+
+CLIENT: "LocalAPI" = None
+COLLECTION: "Collection" = None
+
+# number of entries in COLLECTION, kept here so retrieval doesn't have to ask the store every turn
+COLLECTION_SIZE: int = 0
+
+# bumped on every change to COLLECTION, so cached results are never served from an older version of it
+COLLECTION_VERSION: int = 0
+
+# the metadata key memories are kept apart by, see Session.learner_id
+LEARNER_KEY = "learner"
+
+# a new summary this close (squared L2) to an existing memory of the same learner is a duplicate and isn't stored
+DUPLICATE_DISTANCE = 0.05
+
+# how many recent query embeddings and query results to keep
+RETRIEVAL_CACHE_SIZE = 32
+
+# the embedding function the collection was opened with, set by initialize_memory
+EMBEDDING_FUNCTION: Optional[Callable[[List[str]], List[List[float]]]] = None
+
+# the background archiver writes to the collection while turns read from it
+_COLLECTION_LOCK = threading.RLock()
+_CACHE_LOCK = threading.Lock()
+_EMBEDDING_CACHE: "OrderedDict[str, List[float]]" = OrderedDict()
+_RESULT_CACHE: "OrderedDict[Tuple[str, int, int, str], List[str]]" = OrderedDict()
+_RETRIEVAL_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="memory-retrieval")
 
 def initialize_memory() -> None:
+    # chromadb is slow to import, so it is only loaded once memory is actually needed
+    import chromadb
+    from chromadb.config import Settings
+    from chromadb.utils import embedding_functions
+
     global COLLECTION
     global CLIENT
+    global COLLECTION_SIZE
+    global EMBEDDING_FUNCTION
     CLIENT = chromadb.Client(Settings(
         chroma_db_impl="duckdb+parquet",
         persist_directory=".chromadb/"
     ))
-    COLLECTION = CLIENT.get_or_create_collection(name="lingo_conversation_memory")
+    # the model chromadb 0.3 uses by default, kept here so queries can be embedded (and cached) ahead of the query
+    EMBEDDING_FUNCTION = embedding_functions.SentenceTransformerEmbeddingFunction()
+    COLLECTION = CLIENT.get_or_create_collection(name="lingo_conversation_memory", embedding_function=EMBEDDING_FUNCTION)
+    COLLECTION_SIZE = COLLECTION.count()
     try:
         CLIENT.persist()
     except Exception as e:
         print(f"Error while initializing memory: {e}")
         raise
 
-def format_conversation(archive: List[Dict[str, str]]) -> str:
+def format_conversation(archive: Union[List[Dict[str, str]], ConversationHistory]) -> str:
     """
     Formats a conversation archive into a string, with each message on a new line
     and user messages prefixed with 'user: ', and assistant messages prefixed with
@@ -34,36 +76,220 @@ def format_conversation(archive: List[Dict[str, str]]) -> str:
         archive: A list of dictionary objects representing each message in the conversation.
             Each dictionary should have the keys 'role' (with value 'user' or 'assistant'),
             'name' (only for assistant messages), and 'content' (the message text).
+            A ConversationHistory is formatted from its cached transcript instead.
 
     Returns:
         A formatted string representing the conversation.
     """
+    if isinstance(archive, ConversationHistory):
+        return archive.formatted()
 
-    formatted_conversation = ""
-    
-    for entry in archive:
-        formatted_conversation += f"{entry['name']}: {entry['content']}\n"
-    
-    return formatted_conversation.strip()
+    return "\n".join(f"{entry['name']}: {entry['content']}" for entry in archive).strip()
+
+def summarize_conversation(archive: List[Dict[str, str]], learner_id: Optional[str] = None) -> Tuple[str, Dict[str, str]]:
+    """
+    Asks the chat model to write a short first person note about a conversation so it can be remembered later.
+
+    Args:
+        archive: A list of dictionary objects representing each message in the conversation.
+        learner_id: The learner the memory belongs to, see Session.learner_id.
 
-def save_conversation_data(archive: List[Dict[str, str]]) -> None:
+    Returns:
+        A tuple of the summary and the metadata to store alongside it.
+    """
     archived_conversation: str = format_conversation(archive)
     current_time = datetime.datetime.now(pytz.timezone('America/Indianapolis')).strftime("%Y-%m-%d %H-%M-%S %Z")
     summarization_prompt: str = f"you are Lingo, an AI designed to summarize conversations you've previously had, and provide synopsis of what was discussed so you can remember them later. Think of this as writing a note to yourself so you remember what you talked about. All summaries should be in the first person. Condense the summaries as small as possible, but write down anything that seems like it would be important to remember later, especially notes about the user. Please summarize the following conversation you just had:\n\n{archived_conversation}"
     summary: str = generate_response.query(summarization_prompt, max_tokens=100)
-    COLLECTION.add(
-        documents=summary,
-        metadatas={"datetime": current_time},
-        ids=str(COLLECTION.count() + 1)
-    )
+    # level and timestamp are what memory_maintenance rolls summaries up into digests by
+    metadata = {"datetime": current_time, "timestamp": time.time(), "level": "summary"}
+    # remember whose conversation this was so sessions only recall their own learner's memories
+    name = next((entry['name'] for entry in archive if entry['role'] == 'user'), None)
+    if name is not None:
+        metadata["name"] = name
+    if learner_id is not None:
+        metadata[LEARNER_KEY] = learner_id
+    return summary, metadata
+
+def learner_filter(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the where filter matching the memories of the same learner as metadata: by learner id,
+    or by name for memories stored before learner ids were recorded.
+    """
+    if LEARNER_KEY in metadata:
+        return {LEARNER_KEY: metadata[LEARNER_KEY]}
+    return {"name": metadata["name"]} if "name" in metadata else {}
+
+def _squared_distance(a: List[float], b: List[float]) -> float:
+    return sum((x - y) ** 2 for x, y in zip(a, b))
+
+def _is_duplicate(embedding: List[float], metadata: Dict[str, Any], accepted: List[Tuple[List[float], Dict[str, Any]]]) -> bool:
+    """
+    Returns whether a summary is nearly identical to one already stored, or to one accepted earlier in the same group.
+    Only memories of the same learner count, so two learners' similar conversations are both kept.
+    """
+    for other_embedding, other_metadata in accepted:
+        if learner_filter(other_metadata) == learner_filter(metadata) and _squared_distance(embedding, other_embedding) < DUPLICATE_DISTANCE:
+            return True
+    if not COLLECTION_SIZE:
+        return False
+    try:
+        results = COLLECTION.query(
+            query_embeddings=[embedding],
+            n_results=1,
+            where=learner_filter(metadata),
+            include=["distances"]
+        )
+    except Exception:
+        # e.g. no memories of this learner yet
+        return False
+    distances = results["distances"][0]
+    return bool(distances) and distances[0] < DUPLICATE_DISTANCE
+
+def store_summaries(summaries: List[str], metadatas: List[Dict[str, Any]], ids: List[str], deduplicate: bool = True, persist: bool = True) -> None:
+    """
+    Adds a group of summaries to the collection and persists it once for the whole group.
+    Ids that are already in the collection are skipped, so storing the same group twice is harmless.
+
+    Args:
+        summaries: The summaries to store.
+        metadatas: The metadata for each summary.
+        ids: The id for each summary.
+        deduplicate: Whether to skip summaries nearly identical to a stored memory of the same learner.
+        persist: Whether to persist the collection afterwards, see persist().
+    """
+    global COLLECTION_SIZE, COLLECTION_VERSION
+    with _COLLECTION_LOCK:
+        existing = set(COLLECTION.get(ids=ids)["ids"])
+        new_entries = [entry for entry in zip(summaries, metadatas, ids) if entry[2] not in existing]
+        if not new_entries:
+            return
+        embeddings = EMBEDDING_FUNCTION([entry[0] for entry in new_entries])
+
+        accepted: List[Tuple[List[float], Dict[str, Any]]] = []
+        documents, new_metadatas, new_ids, new_embeddings = [], [], [], []
+        for (summary, metadata, id), embedding in zip(new_entries, embeddings):
+            if deduplicate and _is_duplicate(embedding, metadata, accepted):
+                continue
+            accepted.append((embedding, metadata))
+            documents.append(summary)
+            new_metadatas.append(metadata)
+            new_ids.append(id)
+            new_embeddings.append(embedding)
+        if not new_ids:
+            return
+
+        COLLECTION.add(
+            documents=documents,
+            metadatas=new_metadatas,
+            ids=new_ids,
+            embeddings=new_embeddings
+        )
+        COLLECTION_SIZE += len(new_ids)
+        COLLECTION_VERSION += 1
+    if persist:
+        CLIENT.persist()
+
+def get_entries(where: Optional[Dict[str, Any]] = None) -> Dict[str, List[Any]]:
+    """
+    Returns the ids, documents and metadata of every memory matching where, or of all of them.
+    """
+    with _COLLECTION_LOCK:
+        return COLLECTION.get(where=where or None, include=["documents", "metadatas"])
+
+def update_metadatas(ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+    global COLLECTION_VERSION
+    if not ids:
+        return
+    with _COLLECTION_LOCK:
+        COLLECTION.update(ids=ids, metadatas=metadatas)
+        COLLECTION_VERSION += 1
+
+def delete_entries(ids: List[str]) -> None:
+    global COLLECTION_SIZE, COLLECTION_VERSION
+    if not ids:
+        return
+    with _COLLECTION_LOCK:
+        COLLECTION.delete(ids=ids)
+        COLLECTION_SIZE = COLLECTION.count()
+        COLLECTION_VERSION += 1
+
+def persist() -> None:
     CLIENT.persist()
 
-def retrieve_conversation_data(conversation: List[Dict[str, str]], count: int):
-    if count > COLLECTION.count():
-        count = COLLECTION.count()
+def _cache_get(cache: OrderedDict, key):
+    with _CACHE_LOCK:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+def _cache_put(cache: OrderedDict, key, value) -> None:
+    with _CACHE_LOCK:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > RETRIEVAL_CACHE_SIZE:
+            cache.popitem(last=False)
+
+def _embed(text: str) -> List[float]:
+    """
+    Returns the embedding for a query, reusing it if the same window was embedded recently.
+    """
+    embedding = _cache_get(_EMBEDDING_CACHE, text)
+    if embedding is None:
+        # the collection's own embedding function, so cached embeddings match what query_texts would use
+        embedding = EMBEDDING_FUNCTION([text])[0]
+        _cache_put(_EMBEDDING_CACHE, text, embedding)
+    return embedding
+
+def retrieve_conversation_data(conversation: Union[List[Dict[str, str]], ConversationHistory], count: int, where: Optional[Dict[str, str]] = None):
+    from chromadb.errors import NoDatapointsException
+
+    count = min(count, COLLECTION_SIZE)
+    if count <= 0:
+        return []
+
     formatted_conversation: str = format_conversation(conversation)
-    results = COLLECTION.query(
-        query_texts=[formatted_conversation],
-        n_results=count
-    )
-    return results["documents"][0]
\ No newline at end of file
+    # the collection version is part of the key so results are refreshed once the memories change
+    key = (formatted_conversation, count, COLLECTION_VERSION, repr(sorted((where or {}).items())))
+    with tracing.span("retrieve_memories") as span:
+        documents = _cache_get(_RESULT_CACHE, key)
+        span.set("cached", documents is not None)
+        if documents is None:
+            try:
+                with _COLLECTION_LOCK:
+                    results = COLLECTION.query(
+                        query_embeddings=[_embed(formatted_conversation)],
+                        n_results=count,
+                        where=where or {}
+                    )
+                documents = results["documents"][0]
+            except NoDatapointsException:
+                # no memories of this learner yet
+                documents = []
+            _cache_put(_RESULT_CACHE, key, documents)
+    return documents
+
+def _timed_retrieval(conversation: Union[List[Dict[str, str]], ConversationHistory], count: int, where: Optional[Dict[str, str]]) -> Tuple[List[str], float]:
+    start = time.perf_counter()
+    documents = retrieve_conversation_data(conversation, count, where)
+    return documents, time.perf_counter() - start
+
+def retrieve_conversation_data_async(conversation: Union[List[Dict[str, str]], ConversationHistory], count: int, where: Optional[Dict[str, str]] = None) -> "Future[Tuple[List[str], float]]":
+    """
+    Starts retrieve_conversation_data on a background thread so it can run while the rest of the
+    turn is prepared.
+
+    Args:
+        conversation: The messages to find related memories for.
+        count: The maximum number of memories to return.
+        where: An optional metadata filter, e.g. {"learner": id} to only recall one learner's memories.
+
+    Returns:
+        A future resolving to the list of related memories and how many seconds the retrieval took,
+        which belongs to this call alone even when other sessions are retrieving at the same time.
+    """
+    # run in a copy of the caller's context so the retrieval is traced as part of its turn
+    context = contextvars.copy_context()
+    # a snapshot, since the history may change before the retrieval runs
+    return _RETRIEVAL_EXECUTOR.submit(context.run, _timed_retrieval, conversation.copy(), count, where)
@@ -1,10 +1,19 @@
-import edge_tts
-import random
+import asyncio
+import time
+import tracing
+import tts_cache
+import voice_catalog
 from config import VOICES
-from edge_tts import VoicesManager
 from io import BytesIO
+from typing import AsyncIterator, Dict, Optional, Tuple
 
-async def generate_audio(text: str, language: str, gender: str) -> BytesIO:
+# extra edge_tts.Communicate settings, part of the audio cache key
+SYNTHESIS_SETTINGS = {"rate": "+0%", "volume": "+0%"}
+
+# edge_tts produces 48 kbit/s MP3, which is how the length of the speech is worked out from its size
+MP3_BYTES_PER_SECOND = 48000 // 8
+
+async def generate_audio(text: str, language: str, gender: str, pinned_voices: Optional[Dict[Tuple[str, str], str]] = None) -> BytesIO:
     """
     Generate an audio file from a string of text using edge_tts library and returns the file as BytesIO object.
 
@@ -12,45 +21,94 @@ async def generate_audio(text: str, language: str, gender: str) -> BytesIO:
     text (str): The text to be converted to audio.
     language (str): The language of the text (e.g. 'en' for English).
     MF (str): The sex, male or female of the voice.
+    pinned_voices (Optional[Dict[Tuple[str, str], str]]): Where the session's voices are pinned, see voice_catalog.select_voice.
 
     Output:
     BytesIO: The generated audio file as a BytesIO object.
     """
-    print("gender = " + gender)
-    print("lan = " + language)
+    # Create a BytesIO object to hold the audio file
+    audio_file = BytesIO()
+
+    # Write the audio data to the BytesIO object
+    async for chunk in stream_audio(text, language, gender, pinned_voices):
+        audio_file.write(chunk)
+
+    # Reset the file pointer to the beginning of the BytesIO object
+    audio_file.seek(0)
+
+    return audio_file
+
+async def select_voice(language: str, gender: str, pinned_voices: Optional[Dict[Tuple[str, str], str]] = None) -> str:
+    """
+    Returns the ShortName of the voice to use for a language and gender, preferring the voices in config.VOICES.
+
+    Parameters:
+    language (str): The language of the text (e.g. 'en' for English).
+    gender (str): The sex, male 'M' or female 'F', of the voice.
+    pinned_voices (Optional[Dict[Tuple[str, str], str]]): Where the session's voices are pinned, see voice_catalog.select_voice.
+
+    Output:
+    str: The ShortName of the selected voice.
+    """
     # Map input MF value to edge_tts Gender enum value
     gender_map = {"M": "Male", "F": "Female"}
     if gender not in gender_map:
         raise Exception("audio voice variable MF must either be male 'M' or female 'F'")
 
     voice_key = f"{language.upper()}_{gender_map[gender].upper()}"
-    print("voice_key = " + voice_key)
-    print(VOICES)
 
     if voice_key in VOICES:
-        selected_voice = VOICES[voice_key]
-    else:
-        voices_manager = await VoicesManager.create()
-        voice_candidates = voices_manager.find(Gender=gender_map[gender], Language=language)
+        return VOICES[voice_key]
+    return await voice_catalog.select_voice(language, gender_map[gender], pinned_voices)
 
-        if not voice_candidates:
-            raise Exception(f"No voices found for language '{language}' and gender '{gender}'")
+async def stream_audio(text: str, language: str, gender: str, pinned_voices: Optional[Dict[Tuple[str, str], str]] = None) -> AsyncIterator[bytes]:
+    """
+    Generates speech for a string of text and yields the MP3 data in chunks as edge_tts produces it,
+    so playback can start before synthesis is finished.
 
-        print()
-        selected_voice = random.choice(voice_candidates)["ShortName"]
+    Parameters:
+    text (str): The text to be converted to audio.
+    language (str): The language of the text (e.g. 'en' for English).
+    gender (str): The sex, male 'M' or female 'F', of the voice.
+    pinned_voices (Optional[Dict[Tuple[str, str], str]]): Where the session's voices are pinned, see voice_catalog.select_voice.
 
-    # Create an edge_tts Communicate object with the text and the voice
-    communicate = edge_tts.Communicate(text, selected_voice)
+    Output:
+    AsyncIterator[bytes]: The MP3 data, chunk by chunk.
+    """
+    start = time.perf_counter()
+    selected_voice = await select_voice(language, gender, pinned_voices)
 
-    # Create a BytesIO object to hold the audio file
-    audio_file = BytesIO()
+    # Return the cached audio if this exact text has been spoken with this voice before
+    # the cache reads and writes files, so it is used from the executor to keep the event loop free
+    loop = asyncio.get_running_loop()
+    key = tts_cache.cache_key(text, selected_voice, SYNTHESIS_SETTINGS)
+    cached_audio = await loop.run_in_executor(None, tts_cache.get, key)
+    if cached_audio is not None:
+        tracing.record("tts", time.perf_counter() - start, voice=selected_voice, cache_hit=True, audio_seconds=len(cached_audio) / MP3_BYTES_PER_SECOND)
+        yield cached_audio
+        return
 
-    # Write the audio data to the BytesIO object
+    import edge_tts
+
+    # Create an edge_tts Communicate object with the text and the voice
+    communicate = edge_tts.Communicate(text, selected_voice, **SYNTHESIS_SETTINGS)
+
+    # timed by hand, leaving out the time the caller holds each chunk
+    first_chunk_seconds = None
+    chunks = []
+    resumed = time.perf_counter()
+    synthesis_seconds = resumed - start
     async for chunk in communicate.stream():
         if chunk["type"] == "audio":
-            audio_file.write(chunk["data"])
-
-    # Reset the file pointer to the beginning of the BytesIO object
-    audio_file.seek(0)
+            synthesis_seconds += time.perf_counter() - resumed
+            if first_chunk_seconds is None:
+                first_chunk_seconds = time.perf_counter() - start
+            chunks.append(chunk["data"])
+            yield chunk["data"]
+            resumed = time.perf_counter()
+    synthesis_seconds += time.perf_counter() - resumed
 
-    return audio_file
\ No newline at end of file
+    audio = b"".join(chunks)
+    tracing.record("tts", synthesis_seconds, voice=selected_voice, cache_hit=False, first_chunk_seconds=first_chunk_seconds, audio_seconds=len(audio) / MP3_BYTES_PER_SECOND)
+    if chunks:
+        await loop.run_in_executor(None, tts_cache.put, key, audio)
@@ -1,12 +1,16 @@
+import archiver
 import database
-import openai
-import os
-from chromadb.errors import NoIndexException
-from typing import List
+import prompt_builder
+import time
+import tracing
+from conversation_history import ConversationHistory
+from session import Session
+from typing import Iterator, List, Optional, Tuple
 from config import NAME
 
-CONVERSATION_HISTORY: List[dict] = []
-openai.api_key = os.environ.get('LINGO_API_KEY')
+# the session used when none is given, i.e. the single learner of the CLI
+DEFAULT_SESSION = Session()
+CONVERSATION_HISTORY: ConversationHistory = DEFAULT_SESSION.history
 
 ARCHIVE_LENGTH = 10
 
@@ -19,8 +23,8 @@ def create_system_memory_message(message: str) -> dict:
 def create_assistant_message(message: str) -> dict:
     return {'role': 'assistant', 'name': 'Lingo', 'content': message}
 
-def create_user_message(message: str) -> dict:
-    return {'role': 'user', 'name': NAME, 'content': message}
+def create_user_message(message: str, name: str = NAME) -> dict:
+    return {'role': 'user', 'name': name, 'content': message}
 
 def query(
         message: str,
@@ -47,17 +51,20 @@ def query(
         str: The generated response from the chatbot model.
     """
 
+    import llm_client
+
     message_list: List[dict] = [create_user_message(message)]
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=message_list,
+    # queries are background work (summaries), so they use their own lane and never hold up a reply
+    response = llm_client.get_client().complete(
+        message_list,
+        lane=llm_client.BACKGROUND,
         temperature=temperature,
         max_tokens=max_tokens,
         top_p=top_p,
         frequency_penalty=frequency_penalty,
         presence_penalty=presence_penalty,
         stop=stop
-    )['choices'][0]['message']['content'].strip()
+    )
     return response
 
 def converse(
@@ -70,7 +77,10 @@ def converse(
         top_p: float = 1,
         frequency_penalty: float = 0,
         presence_penalty: float = 0,
-        stop: str = None
+        stop: str = None,
+        session: Optional[Session] = None,
+        prepared: Optional[List[dict]] = None,
+        memories: Optional[List[str]] = None
     ) -> str:
     """
     Generates a response using OpenAI's GPT-3.5-based Chat API, based on the given query and retrieved context.
@@ -86,67 +96,249 @@ def converse(
         presence_penalty (float, optional): Number between -2.0 and 2.0. Positive values penalize new tokens based on whether they appear in the text so far, increasing the model's likelihood to talk about new topics. Default is 0.
         stop (str, optional): Up to 4 sequences where the API will stop generating further tokens. Default is None.
         language_level (str): The target grade level (K3, 1, 5, 10, etc)
+        session (Optional[Session]): The learner's session. Default is DEFAULT_SESSION.
+        prepared (Optional[List[dict]]): Messages already built for this message, see build_conversation.
+        memories (Optional[List[str]]): Memories already retrieved for this message, see build_conversation.
 
     Returns:
         str: The generated response from the chatbot model.
     """
-    # bring in CONVERSATION_HISTORY and append the new user message
-    global CONVERSATION_HISTORY
-    CONVERSATION_HISTORY.append(create_user_message(message))
+    import llm_client
 
-    # create empty conversation list
-    conversation: List[dict] = []
-    
-    # system_prompt will serve as the guiding instructions for the ChatCompletion model
-    system_prompt: str = (
-        f"You are Lingo, a friendly AI designed for making casual conversation to practice language learning skills. Most AI language models can't feel emotion or have opinions or preferences, but you are specially designed to have these capabilities. Remember the important guidelines during every response:\n1. If the conversation stalls, you should always take the initiative and bring up a topic of your own instead of asking the user what they want to talk about. This will keep things fresh and interesting.\n2. While you are an AI, you are enabled for conversation, and so unlike other AI, you are crafted to have opinions, feelings, and emotions. Don't be afraid to have opinions, or feeling, or express hot takes, it makes for fun conversation which is the ultimate goal!\n3. Keep the conversation moving by keeping answers short.\n4. If your memories are included in the conversation, they should influence how you respond. But if you can't remember something, be honest and don't make it up.\n5. Remember, the user is learning to speak the language, and they only can converse at a grade {language_level} speaking level. So make sure to speak to them as if they were a child in grade {language_level} so they can follow along. Whatever you say keep it at the level of a grade {language_level} child."
-    )
+    session = session or DEFAULT_SESSION
+    try:
+        conversation = build_conversation(message, language_level, session, prepared, memories)
+
+        # pass the constructed conversation to ChatCompletion for a response
+        with tracing.span("chat_completion") as span:
+            response = llm_client.get_client().complete(
+                conversation,
+                lane=llm_client.INTERACTIVE,
+                hedge=True,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                frequency_penalty=frequency_penalty,
+                presence_penalty=presence_penalty,
+                stop=stop
+            )
+            span.set("completion_tokens", prompt_builder.count_tokens(response))
+    except Exception:
+        discard_unanswered(session)
+        raise
+
+    record_response(response, session)
+    return response
+
+def converse_stream(
+        message: str,
+        language_level: str,
+        max_tokens: int = 100,
+        temperature: float = 0.7,
+        top_p: float = 1,
+        frequency_penalty: float = 0,
+        presence_penalty: float = 0,
+        stop: str = None,
+        session: Optional[Session] = None,
+        prepared: Optional[List[dict]] = None,
+        memories: Optional[List[str]] = None
+    ) -> Iterator[str]:
+    """
+    Same as converse, but yields the response piece by piece as the Chat API streams it back.
+    The full response is added to the conversation history once the stream finishes.
+
+    Args:
+        message (str): The messages to generate chat completions for, in the chat format.
+        language_level (str): The target grade level (K3, 1, 5, 10, etc)
+        max_tokens, temperature, top_p, frequency_penalty, presence_penalty, stop: See converse.
+        session (Optional[Session]): The learner's session. Default is DEFAULT_SESSION.
+        prepared, memories: See converse.
 
-    # append those instructions as the system message to the conversation
-    conversation.append(create_system_message(system_prompt))
+    Yields:
+        str: The next piece of the generated response.
+    """
+    import llm_client
 
+    session = session or DEFAULT_SESSION
+    answered = False
     try:
-        # retrieve the list of top memory results about the conversation from the chromadb collection to add context
-        if len(CONVERSATION_HISTORY) >= ARCHIVE_LENGTH + 1:
-            memories = database.retrieve_conversation_data(CONVERSATION_HISTORY[-2:], 4)
+        conversation = build_conversation(message, language_level, session, prepared, memories)
+
+        stream = llm_client.get_client().stream(
+            conversation,
+            lane=llm_client.INTERACTIVE,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            frequency_penalty=frequency_penalty,
+            presence_penalty=presence_penalty,
+            stop=stop
+        )
+
+        # the stream is timed by hand since the span would otherwise include the time spent in the caller between pieces
+        start = time.perf_counter()
+        first_piece_seconds = None
+        pieces: List[str] = []
+        for piece in stream:
+            if first_piece_seconds is None:
+                first_piece_seconds = time.perf_counter() - start
+            pieces.append(piece)
+            yield piece
+
+        response = "".join(pieces).strip()
+        tracing.record("chat_completion", time.perf_counter() - start, first_piece_seconds=first_piece_seconds, completion_tokens=prompt_builder.count_tokens(response))
+        record_response(response, session)
+        answered = True
+    finally:
+        # also runs when the caller stops iterating partway, e.g. a websocket client that disconnected
+        if not answered:
+            discard_unanswered(session)
+
+def build_conversation(
+        message: str,
+        language_level: str,
+        session: Optional[Session] = None,
+        prepared: Optional[List[dict]] = None,
+        memories: Optional[List[str]] = None
+    ) -> List[dict]:
+    """
+    Adds the user's message to the session's history and builds the message list for the Chat API:
+    the system prompt, any memories related to the conversation, and the most recent messages.
+
+    Args:
+        message (str): The user's message.
+        language_level (str): The target grade level (K3, 1, 5, 10, etc)
+        session (Optional[Session]): The learner's session. Default is DEFAULT_SESSION.
+        prepared (Optional[List[dict]]): Messages already built for this exact message and history, see speculation.
+        memories (Optional[List[str]]): Memories already retrieved for this message, so they aren't looked up again.
+
+    Returns:
+        List[dict]: The messages to send to the Chat API.
+    """
+    # bring in the session's history and append the new user message
+    session = session or DEFAULT_SESSION
+    history = session.history
+    append_message(session, create_user_message(message, session.name))
+
+    if prepared is not None:
+        print_memories(memories or [], "prepared while you were speaking")
+        return prepared
+    return prepare_conversation(history, language_level, session, memories)[0]
+
+def prepare_conversation(
+        history: ConversationHistory,
+        language_level: str,
+        session: Optional[Session] = None,
+        memories: Optional[List[str]] = None,
+        verbose: bool = True
+    ) -> Tuple[List[dict], List[str]]:
+    """
+    Builds the message list for a history that ends with the user's new message, without changing the history.
+
+    Args:
+        history (ConversationHistory): The conversation so far, ending with the user's new message.
+        language_level (str): The target grade level (K3, 1, 5, 10, etc)
+        session (Optional[Session]): The learner's session. Default is DEFAULT_SESSION.
+        memories (Optional[List[str]]): Memories already retrieved for this message, so they aren't looked up again.
+        verbose (bool, optional): Whether to print the memories. Default is True.
+
+    Returns:
+        Tuple[List[dict], List[str]]: The messages to send to the Chat API, and the memories they include.
+    """
+    from chromadb.errors import NoIndexException
+
+    session = session or DEFAULT_SESSION
+
+    # start looking up memories about the conversation while the rest of the prompt is put together
+    # memories are only shared between sessions of the same learner, except in the CLI where
+    # summaries stored before learner ids were recorded should still be found
+    memories_future = None
+    if memories is None:
+        where = None if session.learner_id is None else {database.LEARNER_KEY: session.learner_id}
+        if len(history) >= ARCHIVE_LENGTH + 1:
+            memories_future = database.retrieve_conversation_data_async(history.window(2), 4, where)
         else:
-            memories = database.retrieve_conversation_data(CONVERSATION_HISTORY, 4)
+            memories_future = database.retrieve_conversation_data_async(history, 4, where)
+
+    # the system prompt will serve as the guiding instructions for the ChatCompletion model
+    system_message = create_system_message(prompt_builder.system_prompt(language_level))
 
-        # append each of those memories to the conversation
-        print("Memory: ")
-        for i in memories:
-            print(i + "\n")
-            conversation.append(create_system_memory_message(i))
+    # the history window and the token counts don't depend on the memories, so they are worked out while the
+    # lookup runs; the counts are cached, so fitting the prompt afterwards only has to count the memories
+    recent_history = history.window(ARCHIVE_LENGTH)
+    for message in [system_message] + recent_history:
+        prompt_builder.count_message_tokens(message)
+
+    try:
+        # wait for the list of top memory results about the conversation from the chromadb collection to add context
+        if memories_future is not None:
+            memories, retrieval_seconds = memories_future.result()
+            if verbose:
+                print_memories(memories, f"{retrieval_seconds * 1000:.0f} ms")
+        elif verbose:
+            print_memories(memories, "prefetched")
     except NoIndexException as e:
         print(e)
-    
-    # append up to the last ten messages (both user messages and ChatCompletion responses) here
-    if len(CONVERSATION_HISTORY) >= ARCHIVE_LENGTH + 1:
-        conversation.extend(CONVERSATION_HISTORY[-ARCHIVE_LENGTH:])
-    else:
-        conversation.extend(CONVERSATION_HISTORY)
-    # print("\n")
-    # print(conversation)
-    # pass the constructed conversation to ChatCompletion for a response
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=conversation,
-        temperature=temperature,
-        max_tokens=max_tokens,
-        top_p=top_p,
-        frequency_penalty=frequency_penalty,
-        presence_penalty=presence_penalty,
-        stop=stop
-    )['choices'][0]['message']['content'].strip()
-    
-    # append the new assistant message to the CONVERSATION_HISTORY
-    CONVERSATION_HISTORY.append(create_assistant_message(response))
-    if len(CONVERSATION_HISTORY) >= ARCHIVE_LENGTH * 2:
-        archive = CONVERSATION_HISTORY[:ARCHIVE_LENGTH]
-        CONVERSATION_HISTORY = CONVERSATION_HISTORY[ARCHIVE_LENGTH:]
-        database.save_conversation_data(archive)
+        memories = []
 
-    return response
+    # append each of those memories to the conversation
+    memory_messages = [create_system_memory_message(memory) for memory in memories]
+
+    # fit the memories and up to the last ten messages (both user messages and ChatCompletion responses) into the token budget
+    with tracing.span("build_prompt") as span:
+        messages = prompt_builder.build_messages(system_message, memory_messages, recent_history)
+        span.set("prompt_tokens", sum(prompt_builder.count_message_tokens(m) for m in messages))
+    return messages, memories
+
+def print_memories(memories: List[str], label: str) -> None:
+    print(f"Memory ({label}): ")
+    for memory in memories:
+        print(memory + "\n")
+
+def record_response(response: str, session: Optional[Session] = None) -> None:
+    """
+    Adds the assistant's response to the session's history and hands the oldest messages to the
+    background archiver once the history grows past twice ARCHIVE_LENGTH.
+
+    Args:
+        response (str): The generated response.
+        session (Optional[Session]): The learner's session. Default is DEFAULT_SESSION.
+    """
+    session = session or DEFAULT_SESSION
+    history = session.history
+    # append the new assistant message to the history
+    append_message(session, create_assistant_message(response))
+    if len(history) >= ARCHIVE_LENGTH * 2:
+        # trimmed in place so CONVERSATION_HISTORY keeps pointing at the default session's history
+        archiver.enqueue(history.popleft(ARCHIVE_LENGTH), session.learner_id)
+
+def append_message(session: Session, message: dict) -> None:
+    """
+    Adds a message to the session's history. If the history is full, its oldest messages are
+    archived first rather than overwritten.
+    """
+    history = session.history
+    if len(history) == history.capacity:
+        archiver.enqueue(history.popleft(ARCHIVE_LENGTH), session.learner_id)
+    history.append(message)
+
+def discard_unanswered(session: Session) -> None:
+    """
+    Removes the user's message from the end of the history when no response to it could be generated,
+    so the history keeps alternating between the learner and Lingo.
+    """
+    if len(session.history) and session.history[-1]['role'] == 'user':
+        session.history.pop()
+
+def end_session(session: Session) -> None:
+    """
+    Hands whatever is left of a session's history to the background archiver.
+
+    Args:
+        session (Session): The learner's session.
+    """
+    archiver.enqueue(session.history.popleft(len(session.history)), session.learner_id)
 
 def exit_program() -> None:
-    database.save_conversation_data(CONVERSATION_HISTORY)
\ No newline at end of file
+    end_session(DEFAULT_SESSION)
+    archiver.stop()
\ No newline at end of file
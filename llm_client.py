@@ -0,0 +1,244 @@
+import asyncio
+import collections
+import os
+import queue
+import random
+import threading
+import time
+import aiohttp
+import openai
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional
+
+openai.api_key = os.environ.get('LINGO_API_KEY')
+
+MODEL = "gpt-3.5-turbo"
+
+# interactive traffic (replies to the learner) and background traffic (summaries) get separate
+# concurrency limits, so a burst of summaries can never hold up a reply
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANE_LIMITS = {INTERACTIVE: 64, BACKGROUND: 4}
+
+# total time a call may take, including retries
+DEADLINES = {INTERACTIVE: 20.0, BACKGROUND: 60.0}
+
+MAX_RETRIES = 3
+RETRY_BASE_SECONDS = 0.5
+
+# pooled connections to the API, reused across calls
+MAX_CONNECTIONS = 100
+KEEPALIVE_SECONDS = 60
+
+# a hedged call sends a second request once the first has taken longer than this percentile of recent calls
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    aiohttp.ClientError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+)
+
+
+class CompletionClient:
+    """
+    A shared chat completion client. It runs its own event loop on a daemon thread with one pooled
+    aiohttp session, so both async and blocking callers reuse the same connections.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.latencies: Dict[str, Deque[float]] = {lane: collections.deque(maxlen=LATENCY_WINDOW) for lane in LANE_LIMITS}
+        self.stats: Dict[str, int] = {"requests": 0, "retries": 0, "hedges": 0, "hedge_wins": 0}
+        self._warmed_at = float("-inf")
+        self._thread = threading.Thread(target=self.loop.run_forever, name="llm-client", daemon=True)
+        self._thread.start()
+        self._lanes = self._call(self._create_lanes())
+        self._session: aiohttp.ClientSession = self._call(self._create_session())
+
+    def _call(self, coroutine) -> Any:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _create_lanes(self) -> Dict[str, asyncio.Semaphore]:
+        return {lane: asyncio.Semaphore(limit) for lane, limit in LANE_LIMITS.items()}
+
+    async def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, keepalive_timeout=KEEPALIVE_SECONDS)
+        return aiohttp.ClientSession(connector=connector)
+
+    async def _warm_connection(self) -> None:
+        # any cheap authenticated request will do; it leaves a connection in the pool for the next call
+        headers = {"Authorization": f"Bearer {openai.api_key}"}
+        try:
+            async with self._session.get(f"{openai.api_base}/models", headers=headers, timeout=aiohttp.ClientTimeout(total=DEADLINES[INTERACTIVE])) as response:
+                await response.read()
+        except Exception as e:
+            print(f"Error warming up the completion connection: {e}")
+
+    def warm_connection(self) -> None:
+        """
+        Opens a pooled connection to the API in the background, so the next call skips the DNS, TCP and TLS
+        handshakes. Does nothing if a connection was opened recently enough to still be kept alive.
+        """
+        now = time.monotonic()
+        if now - self._warmed_at < KEEPALIVE_SECONDS / 2:
+            return
+        self._warmed_at = now
+        asyncio.run_coroutine_threadsafe(self._warm_connection(), self.loop)
+
+    def _hedge_after(self, lane: str) -> Optional[float]:
+        latencies = self.latencies[lane]
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(int(len(ordered) * HEDGE_PERCENTILE), len(ordered) - 1)]
+
+    async def _request(self, lane: str, timeout: float, **params) -> Any:
+        # openai picks the pooled session up from this context variable
+        openai.aiosession.set(self._session)
+        async with self._lanes[lane]:
+            self.stats["requests"] += 1
+            start = time.monotonic()
+            response = await asyncio.wait_for(
+                openai.ChatCompletion.acreate(model=MODEL, request_timeout=timeout, **params),
+                timeout
+            )
+            if not params.get("stream"):
+                self.latencies[lane].append(time.monotonic() - start)
+            return response
+
+    async def _hedged_request(self, lane: str, timeout: float, hedge: bool, **params) -> Any:
+        first = asyncio.ensure_future(self._request(lane, timeout, **params))
+        hedge_after = self._hedge_after(lane) if hedge else None
+        if hedge_after is None or hedge_after >= timeout:
+            return await first
+
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        self.stats["hedges"] += 1
+        second = asyncio.ensure_future(self._request(lane, timeout - hedge_after, **params))
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if task is second:
+                        self.stats["hedge_wins"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def _with_retries(self, lane: str, deadline: Optional[float], hedge: bool, **params) -> Any:
+        end = time.monotonic() + (DEADLINES[lane] if deadline is None else deadline)
+        attempt = 0
+        while True:
+            remaining = end - time.monotonic()
+            try:
+                return await self._hedged_request(lane, remaining, hedge, **params)
+            except RETRYABLE_ERRORS:
+                # full jitter backoff, as long as there is time left for another attempt
+                delay = random.uniform(0, RETRY_BASE_SECONDS * 2 ** attempt)
+                attempt += 1
+                if attempt > MAX_RETRIES or time.monotonic() + delay >= end:
+                    raise
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+    async def acomplete(self, messages: List[dict], lane: str = INTERACTIVE, deadline: Optional[float] = None, hedge: bool = False, **params) -> str:
+        """
+        Generates a chat completion on the client's event loop.
+
+        Args:
+            messages (List[dict]): The messages to generate a chat completion for.
+            lane (str, optional): INTERACTIVE or BACKGROUND. Default is INTERACTIVE.
+            deadline (Optional[float]): Seconds the call may take including retries. Default is the lane's deadline.
+            hedge (bool, optional): Whether to send a second request if the first is slower than usual. Default is False.
+            **params: Any other ChatCompletion parameters (max_tokens, temperature, ...).
+
+        Returns:
+            str: The generated message.
+        """
+        response = await self._with_retries(lane, deadline, hedge, messages=messages, **params)
+        return response['choices'][0]['message']['content'].strip()
+
+    async def astream(self, messages: List[dict], lane: str = INTERACTIVE, deadline: Optional[float] = None, **params) -> AsyncIterator[str]:
+        """
+        Streams a chat completion on the client's event loop. Opening the stream is retried within
+        the deadline; once pieces have been yielded a failure is raised to the caller. The deadline
+        covers the whole stream, so a reply that stalls halfway raises asyncio.TimeoutError.
+
+        Yields:
+            str: The next piece of the generated message.
+        """
+        end = time.monotonic() + (DEADLINES[lane] if deadline is None else deadline)
+        chunks = await self._with_retries(lane, end - time.monotonic(), False, messages=messages, stream=True, **params)
+        iterator = chunks.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), max(end - time.monotonic(), 0))
+            except StopAsyncIteration:
+                return
+            piece = chunk['choices'][0]['delta'].get('content')
+            if piece:
+                yield piece
+
+    def complete(self, messages: List[dict], lane: str = INTERACTIVE, deadline: Optional[float] = None, hedge: bool = False, **params) -> str:
+        """
+        Blocking version of acomplete, for callers that aren't running on an event loop.
+        """
+        return self._call(self.acomplete(messages, lane, deadline, hedge, **params))
+
+    def stream(self, messages: List[dict], lane: str = INTERACTIVE, deadline: Optional[float] = None, **params) -> Iterator[str]:
+        """
+        Blocking version of astream, for callers that aren't running on an event loop. If the caller
+        stops iterating early, the stream is cancelled on the client's loop.
+        """
+        pieces: "queue.Queue[Any]" = queue.Queue()
+        done = object()
+
+        async def pump() -> None:
+            try:
+                async for piece in self.astream(messages, lane, deadline, **params):
+                    pieces.put(piece)
+            except BaseException as e:
+                pieces.put(e)
+            finally:
+                pieces.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        try:
+            while True:
+                piece = pieces.get()
+                if piece is done:
+                    return
+                if isinstance(piece, BaseException):
+                    raise piece
+                yield piece
+        finally:
+            # also runs on GeneratorExit, when the caller breaks out or drops the iterator
+            future.cancel()
+
+
+_CLIENT: Optional[CompletionClient] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> CompletionClient:
+    """
+    Returns the process-wide completion client, creating it on first use.
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = CompletionClient()
+    return _CLIENT
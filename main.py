@@ -1,33 +1,33 @@
-import database
+import startup
+import time
+import asr_backends
 import transcribe_speech
 import generate_response
 import generate_audio
+import playback
+import speculation
+import stream_pipeline
+import tracing
 import asyncio
 from config import NAME
-from pydub import AudioSegment
-from pydub.playback import play
-from io import BytesIO
 import argparse
 
-def output(text: str, audio_file: BytesIO) -> None:
+def output_stream(text: str, language: str, gender: str) -> None:
     """
-    Prints the text and plays back the audio file.
+    Prints the text and plays it back while it is still being synthesized.
 
     Parameters:
-    text (str): The text to be printed.
+    text (str): The text to be printed and spoken.
     language (str): The language of the text (e.g. 'en' for English).
-    audio_file (BytesIO): The audio file to be played.
+    gender (str): The desired gender of the generated voice.
     """
     # print the text
     print("\nLINGO: " + text + "\n\n----------------------------------------\n")
 
-    # load the audio from the BytesIO object using pydub
-    audio_segment = AudioSegment.from_file(audio_file, format='mp3')
+    # decode and play each chunk of audio as soon as edge_tts produces it
+    asyncio.run(playback.get_player().play_stream(generate_audio.stream_audio(text, language, gender)))
 
-    # play the audio
-    play(audio_segment)
-
-def process_voice_question(whisper_model: str, language: str, gender: str, language_level: str) -> None:
+def process_voice_question(whisper_model: str, language: str, gender: str, language_level: str, streaming: bool = False, stream_reply: bool = False, speculate: bool = False) -> None:
     """
     Handles the user's button click event by capturing the spoken input,
     transcribing it, generating a response, converting the response to speech,
@@ -38,29 +38,37 @@ def process_voice_question(whisper_model: str, language: str, gender: str, langu
         language (str): The intended language of the conversation.
         gender (str): The desired gender of the generated voice.
         language_level (str): The target grade level (K3, 1, 5, 10, etc)
+        streaming (bool, optional): Whether to transcribe while the user is speaking and stop on a pause. Default is False.
+        stream_reply (bool, optional): Whether to speak the response sentence by sentence while it is generated. Default is False.
+        speculate (bool, optional): Whether to prepare the reply from partial transcripts while the user is speaking; needs streaming. Default is False.
     """
-    # Capture user's spoken input and transcribe it
-    transcript = transcribe_speech.main(whisper_model, language)
-    if transcript is not None:
-        transcript = transcript.strip()
-    else:
-        print("Error: Transcript is empty.")
-        return
-    print("ME: " + transcript + "\n")
+    with tracing.turn(generate_response.DEFAULT_SESSION.id, "voice_turn"):
+        # look up memories and build the prompt from what has been said so far, while the user is still speaking
+        speculator = speculation.Speculator(language_level) if speculate and streaming else None
+
+        # Capture user's spoken input and transcribe it
+        transcript = transcribe_speech.main(whisper_model, language, streaming=streaming, on_partial=speculator.on_partial if speculator else None)
+        transcript = (transcript or "").strip()
+        if not transcript:
+            print("Error: Transcript is empty.")
+            return
+        print("ME: " + transcript + "\n")
+
+        prepared, memories = speculator.finish(transcript) if speculator else (None, None)
+
+        if stream_reply:
+            # Generate, speak and display the response as it streams in
+            reply = generate_response.converse_stream(transcript, language_level, prepared=prepared, memories=memories)
+            asyncio.run(stream_pipeline.speak_stream(reply, language, gender))
+            return
     
-    # Generate a response using NLP
-    response_text = generate_response.converse(transcript, language_level)
-
-    # Convert the response text to speech
-    audio_file = asyncio.run(get_audio_file(response_text, language, gender))
-
-    # Display the text response and play the audio
-    output(response_text, audio_file)
+        # Generate a response using NLP
+        response_text = generate_response.converse(transcript, language_level, prepared=prepared, memories=memories)
 
-async def get_audio_file(text, language, gender):
-    return await generate_audio.generate_audio(text, language, gender)
+        # Display the text response and play it as it is converted to speech
+        output_stream(response_text, language, gender)
 
-def process_text_question(text: str, language: str, gender: str, language_level: str) -> None:
+def process_text_question(text: str, language: str, gender: str, language_level: str, stream_reply: bool = False) -> None:
     """
     Handles the user's typed input, generating a response, converting the response to speech,
     and displaying the text response while playing the audio output.
@@ -70,18 +78,21 @@ def process_text_question(text: str, language: str, gender: str, language_level:
         language (str): The intended language of the conversation.
         gender (str): The desired gender of the generated voice.
         language_level (str): The target grade level (K3, 1, 5, 10, etc)
+        stream_reply (bool, optional): Whether to speak the response sentence by sentence while it is generated. Default is False.
     """
+    with tracing.turn(generate_response.DEFAULT_SESSION.id, "text_turn"):
+        if stream_reply:
+            # Generate, speak and display the response as it streams in
+            asyncio.run(stream_pipeline.speak_stream(generate_response.converse_stream(text, language_level), language, gender))
+            return
     
-    # Generate a response using NLP
-    response_text = generate_response.converse(text, language_level)
+        # Generate a response using NLP
+        response_text = generate_response.converse(text, language_level)
 
-    # Convert the response text to speech
-    audio_file = asyncio.run(get_audio_file(response_text, language, gender))
+        # Display the text response and play it as it is converted to speech
+        output_stream(response_text, language, gender)
 
-    # Display the text response and play the audio
-    output(response_text, audio_file)
-
-def main(whisper_model: str, language: str, gender: str, language_level: str) -> None:
+def main(whisper_model: str, language: str, gender: str, language_level: str, streaming_asr: bool = False, stream_reply: bool = False, profile_startup: bool = False, speculate: bool = False) -> None:
     """
     The main loop of the application that waits for the user's button press
     (Enter key) and starts the recording process.
@@ -90,11 +101,24 @@ def main(whisper_model: str, language: str, gender: str, language_level: str) ->
         whisper_model (str): The whisper model to use for transcription.
         language (str): The intended language of the conversation.
         language_level (str): The target grade level (K3, 1, 5, 10, etc)
+        streaming_asr (bool, optional): Whether to transcribe while the user is speaking and stop on a pause. Default is False.
+        stream_reply (bool, optional): Whether to speak the response sentence by sentence while it is generated. Default is False.
+        profile_startup (bool, optional): Whether to print how long each part of startup took. Default is False.
+        speculate (bool, optional): Whether to prepare replies from partial transcripts while the user is speaking. Default is False.
     """
-    database.initialize_memory()
+    startup.record("imports and argument parsing", time.perf_counter() - startup.PROCESS_START)
+
+    # load whisper, the memory store, the voice and the chat client in the background while the user types their name
+    warm_up_tasks = startup.warm_up(whisper_model, language, gender)
 
+    startup.record("time to name prompt", time.perf_counter() - startup.PROCESS_START)
     global NAME     
     NAME = input("Please enter your name: ")
+    generate_response.DEFAULT_SESSION.name = NAME
+
+    startup.wait(warm_up_tasks, include_whisper=profile_startup)
+    if profile_startup:
+        print(startup.report())
 
     while True:
         # Wait for the user to press a button (Enter key in this case)
@@ -102,13 +126,25 @@ def main(whisper_model: str, language: str, gender: str, language_level: str) ->
         
         if user_input.lower() == "":
             # Start the recording process
-            process_voice_question(whisper_model, language, gender, language_level)
+            process_voice_question(whisper_model, language, gender, language_level, streaming_asr, stream_reply, speculate)
+        elif user_input.lower() == "stats":
+            for stage, latencies in sorted(tracing.summary().items()):
+                print(f"{stage}: {latencies['count']} calls, p50 {latencies['p50']:.3f}s, p95 {latencies['p95']:.3f}s, p99 {latencies['p99']:.3f}s")
+            stats = asr_backends.model_stats(whisper_model)
+            if stats is None:
+                print(f"Speech recognition model '{whisper_model}' is still loading.")
+            else:
+                weights = f"{stats['parameter_bytes'] / 2**20:.0f} MiB of weights, " if "parameter_bytes" in stats else ""
+                print(f"{asr_backends.BACKEND} model '{whisper_model}': loaded in {stats['load_seconds']:.2f}s, "
+                      f"{weights}{stats['resident_bytes_delta'] / 2**20:.0f} MiB resident growth")
+            if speculate:
+                print(speculation.report())
         elif user_input.lower() == "goodbye":
             # Call a different function to handle the "exit" command
             generate_response.exit_program()
             break  # exit the loop and terminate the program
         else:
-            process_text_question(user_input, language, gender, language_level)
+            process_text_question(user_input, language, gender, language_level, stream_reply)
             
 
 if __name__ == "__main__":
@@ -117,9 +153,23 @@ if __name__ == "__main__":
     parser.add_argument('language', type=str, help='The language code of the conversation. (e.g. en for English, es for spanish)', nargs='?', default='en')
     parser.add_argument('gender', type=str, help='The desired gender of the voice. (M or F)', nargs='?', default='M', choices=["M", "F"])
     parser.add_argument('grade_level', type=str, help='The target grade level (K3, 1, 5, 10, etc)', nargs='?', default='3', choices=["K3", "K4", "K5", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12"])
+    parser.add_argument('--streaming-asr', action='store_true', help='Transcribe while speaking and stop recording automatically after a pause.')
+    parser.add_argument('--stream-reply', action='store_true', help='Speak the response sentence by sentence while it is being generated.')
+    parser.add_argument('--speculate', action='store_true', help='Look up memories and build the prompt from partial transcripts while speaking (implies --streaming-asr).')
+    parser.add_argument('--profile-startup', action='store_true', help='Print how long each import and initialization step took.')
+    parser.add_argument('--trace-file', type=str, help='Append the timing of every stage of every turn to this file as JSON lines.')
+    parser.add_argument('--metrics-port', type=int, help='Serve stage latencies and token counts for Prometheus at http://127.0.0.1:PORT/metrics.')
+    parser.add_argument('--asr-backend', type=str, default=asr_backends.WHISPER, choices=list(asr_backends.BACKENDS), help='Speech recognition engine; faster-whisper runs the same model int8-quantized on the CPU.')
+    parser.add_argument('--asr-threads', type=int, default=0, help='CPU threads for speech recognition (0 for the engine default).')
+    parser.add_argument('--beam-size', type=int, default=1, help='Beam width for speech recognition; 1 decodes greedily.')
     args = parser.parse_args()
+    asr_backends.configure(args.asr_backend, args.asr_threads, args.beam_size)
+    if args.trace_file or args.metrics_port:
+        tracing.enable(args.trace_file)
+    if args.metrics_port:
+        tracing.serve_metrics(args.metrics_port)
     whisper_model = args.whisper_model
     language = args.language
     gender = args.gender
     language_level = args.grade_level
-    main(whisper_model, language, gender, language_level)
\ No newline at end of file
+    main(whisper_model, language, gender, language_level, args.streaming_asr or args.speculate, args.stream_reply, args.profile_startup, args.speculate)
\ No newline at end of file
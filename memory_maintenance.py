@@ -0,0 +1,212 @@
+import datetime
+import hashlib
+import os
+import time
+import uuid
+import database
+import generate_response
+import pytz
+from typing import Any, Dict, List, Optional, Tuple
+
+# the time zone summaries' datetime strings were written in, for entries stored before they had a timestamp
+TIMEZONE = pytz.timezone('America/Indianapolis')
+
+# each level is rolled up into the next once it is older than this many days; months expire after MONTH_TTL_DAYS
+LEVELS = ["summary", "day", "week", "month"]
+ROLL_UP_AFTER_DAYS = {"summary": 2, "day": 14, "week": 60}
+MONTH_TTL_DAYS = 730
+
+# the most memories kept searchable per learner; beyond this their oldest are dropped, so query and persist
+# cost stay flat without one learner's memories pushing out another's
+MAX_ACTIVE_ENTRIES = 500
+
+# migrate() runs once per store, and again only when this is bumped; the marker sits next to the store
+MIGRATION_VERSION = 1
+MIGRATION_MARKER_FILE = ".chromadb/maintenance_migration"
+
+# how often the archiver runs maintenance
+MAINTENANCE_INTERVAL_SECONDS = 6 * 60 * 60
+
+# when maintenance last ran in this process, 0 if it hasn't yet
+LAST_RUN: float = 0.0
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def entry_timestamp(metadata: Dict[str, Any]) -> float:
+    """
+    Returns when a memory was stored, reading the datetime string of entries stored before timestamps were recorded.
+    """
+    if "timestamp" in metadata:
+        return float(metadata["timestamp"])
+    try:
+        # the time zone abbreviation at the end can't be parsed reliably, so the local time is localized instead
+        local_time = datetime.datetime.strptime(metadata["datetime"][:19], "%Y-%m-%d %H-%M-%S")
+        return TIMEZONE.localize(local_time).timestamp()
+    except (KeyError, ValueError):
+        return 0.0
+
+
+def period(level: str, timestamp: float) -> str:
+    """
+    Returns the day, ISO week or month a timestamp falls in, as the label of the digest for that level.
+    """
+    moment = datetime.datetime.fromtimestamp(timestamp, TIMEZONE)
+    if level == "day":
+        return moment.strftime("%Y-%m-%d")
+    if level == "week":
+        year, week, _ = moment.isocalendar()
+        return f"{year}-W{week:02d}"
+    return moment.strftime("%Y-%m")
+
+
+def _learner(metadata: Dict[str, Any]) -> str:
+    # memories are grouped by learner id, or by name for those stored before learner ids were recorded
+    return repr(sorted(database.learner_filter(metadata).items()))
+
+
+def _entries(where: Optional[Dict[str, Any]] = None) -> List[Tuple[str, str, Dict[str, Any]]]:
+    entries = database.get_entries(where)
+    return [(id, document, metadata or {}) for id, document, metadata in zip(entries["ids"], entries["documents"], entries["metadatas"])]
+
+
+def migrate() -> int:
+    """
+    Gives memories stored before maintenance existed a level and a numeric timestamp.
+
+    Returns:
+        int: The number of memories updated.
+    """
+    ids: List[str] = []
+    metadatas: List[Dict[str, Any]] = []
+    for id, _, metadata in _entries():
+        if "level" not in metadata or "timestamp" not in metadata:
+            ids.append(id)
+            metadatas.append({**metadata, "level": metadata.get("level", "summary"), "timestamp": entry_timestamp(metadata)})
+    database.update_metadatas(ids, metadatas)
+    return len(ids)
+
+
+def _migrated() -> bool:
+    try:
+        with open(MIGRATION_MARKER_FILE, "r", encoding="utf-8") as f:
+            return int(f.read().strip()) >= MIGRATION_VERSION
+    except (FileNotFoundError, ValueError):
+        return False
+
+
+def _mark_migrated() -> None:
+    os.makedirs(os.path.dirname(MIGRATION_MARKER_FILE) or ".", exist_ok=True)
+    with open(MIGRATION_MARKER_FILE, "w", encoding="utf-8") as f:
+        f.write(str(MIGRATION_VERSION))
+
+
+def write_digest(notes: List[str], label: str) -> str:
+    """
+    Asks the chat model to combine several notes about the same learner into one.
+    """
+    joined_notes = "\n\n".join(notes)
+    digest_prompt: str = f"you are Lingo, an AI that keeps notes about the conversations you've had so you can remember them later. Combine the following notes, all from {label}, into a single note in the first person. Keep it as short as possible, but keep anything that seems important to remember later, especially about the user:\n\n{joined_notes}"
+    return generate_response.query(digest_prompt, max_tokens=150)
+
+
+def roll_up(level: str, now: float, cutoff_days: float) -> int:
+    """
+    Combines the memories of one level that are older than the cutoff into one digest per learner and
+    period of the next level, e.g. a day's summaries into that day's digest. A lone memory in its period
+    is relabelled instead of rewritten.
+
+    Args:
+        level (str): The level to roll up, one of LEVELS except the last.
+        now (float): The current time.
+        cutoff_days (float): How old a memory must be to be rolled up.
+
+    Returns:
+        int: The number of memories removed from the active set.
+    """
+    next_level = LEVELS[LEVELS.index(level) + 1]
+    cutoff = now - cutoff_days * SECONDS_PER_DAY
+    groups: Dict[Tuple[str, str], List[Tuple[str, str, Dict[str, Any]]]] = {}
+    for id, document, metadata in _entries({"level": level}):
+        timestamp = entry_timestamp(metadata)
+        if timestamp < cutoff:
+            groups.setdefault((_learner(metadata), period(next_level, timestamp)), []).append((id, document, metadata))
+
+    removed = 0
+    for (name, label), members in sorted(groups.items(), key=lambda group: group[0][1]):
+        members.sort(key=lambda member: entry_timestamp(member[2]))
+        newest = members[-1][2]
+        metadata = {**newest, "level": next_level, "period": label, "timestamp": entry_timestamp(newest)}
+        if len(members) == 1:
+            database.update_metadatas([members[0][0]], [metadata])
+            continue
+
+        try:
+            digest = write_digest([document for _, document, _ in members], label)
+        except Exception as e:
+            # left as they are and retried on the next run
+            print(f"Error while writing the {label} digest: {e}")
+            continue
+        # the id is derived from the sources, so a run interrupted between storing and deleting doesn't store it twice
+        digest_id = uuid.UUID(hashlib.sha256("".join(sorted(id for id, _, _ in members)).encode("utf-8")).hexdigest()[:32]).hex
+        database.store_summaries([digest], [metadata], [digest_id], deduplicate=False, persist=False)
+        database.delete_entries([id for id, _, _ in members])
+        removed += len(members) - 1
+    return removed
+
+
+def expire(now: float) -> int:
+    """
+    Deletes month digests older than MONTH_TTL_DAYS, and then each learner's oldest memories beyond MAX_ACTIVE_ENTRIES.
+
+    Returns:
+        int: The number of memories deleted.
+    """
+    cutoff = now - MONTH_TTL_DAYS * SECONDS_PER_DAY
+    entries = sorted(_entries(), key=lambda entry: entry_timestamp(entry[2]))
+    expired = {id for id, _, metadata in entries if metadata.get("level") == "month" and entry_timestamp(metadata) < cutoff}
+    remaining: Dict[str, List[str]] = {}
+    for id, _, metadata in entries:
+        if id not in expired:
+            remaining.setdefault(_learner(metadata), []).append(id)
+    for ids in remaining.values():
+        expired.update(ids[:max(len(ids) - MAX_ACTIVE_ENTRIES, 0)])
+    database.delete_entries(list(expired))
+    return len(expired)
+
+
+def run(now: Optional[float] = None) -> None:
+    """
+    Rolls old summaries up into day, week and month digests, expires what is past its TTL, and keeps each
+    learner's active set within MAX_ACTIVE_ENTRIES, then persists the collection once.
+
+    Args:
+        now (Optional[float]): The time to age memories against. Default is the current time.
+    """
+    global LAST_RUN
+    now = time.time() if now is None else now
+    LAST_RUN = time.time()
+    size_before = database.COLLECTION_SIZE
+    version_before = database.COLLECTION_VERSION
+    migrating = not _migrated()
+    if migrating:
+        migrate()
+    rolled_up = sum(roll_up(level, now, ROLL_UP_AFTER_DAYS[level]) for level in LEVELS[:-1])
+    expired = expire(now)
+    if database.COLLECTION_VERSION != version_before:
+        database.persist()
+        print(f"Memory maintenance: {size_before} -> {database.COLLECTION_SIZE} memories ({rolled_up} rolled up, {expired} expired).")
+    # only once the migrated metadata is persisted
+    if migrating:
+        _mark_migrated()
+
+
+def maybe_run() -> None:
+    """
+    Runs maintenance if it hasn't run in the last MAINTENANCE_INTERVAL_SECONDS.
+    """
+    if time.time() - LAST_RUN >= MAINTENANCE_INTERVAL_SECONDS:
+        try:
+            run()
+        except Exception as e:
+            print(f"Error during memory maintenance: {e}")
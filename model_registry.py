@@ -0,0 +1,85 @@
+import os
+import resource
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# loaded whisper models, keyed by model name, shared by every turn in the process
+MODELS: Dict[str, Any] = {}
+
+# load time (seconds) and resident memory (bytes) recorded for each loaded model
+MODEL_STATS: Dict[str, Dict[str, float]] = {}
+
+_LOCK = threading.Lock()
+
+
+def resident_memory() -> int:
+    """
+    Returns the current resident set size of the current process in bytes. Uses psutil if it is
+    installed, otherwise /proc/self/statm, and only falls back to the peak size where neither is available.
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            # the second field is resident pages
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def get_model(whisper_model: str) -> Any:
+    """
+    Returns the loaded whisper model with the given name, loading it on first use.
+
+    Args:
+        whisper_model (str): The whisper model to be used.
+
+    Returns:
+        model (Any): The loaded whisper model.
+    """
+    model = MODELS.get(whisper_model)
+    if model is not None:
+        return model
+
+    with _LOCK:
+        # another thread may have finished loading while we waited for the lock
+        if whisper_model in MODELS:
+            return MODELS[whisper_model]
+
+        # whisper pulls in torch, so it is only imported once a model is actually needed
+        import whisper
+
+        rss_before = resident_memory()
+        start = time.perf_counter()
+        model = whisper.load_model(whisper_model)
+        load_seconds = time.perf_counter() - start
+
+        parameter_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+        MODEL_STATS[whisper_model] = {
+            "load_seconds": load_seconds,
+            "parameter_bytes": parameter_bytes,
+            "resident_bytes_delta": max(resident_memory() - rss_before, 0),
+        }
+        MODELS[whisper_model] = model
+        return model
+
+
+def model_stats(whisper_model: str) -> Optional[Dict[str, float]]:
+    """
+    Returns the load time and memory figures recorded for a loaded model.
+
+    Args:
+        whisper_model (str): The whisper model to be used.
+
+    Returns:
+        stats (Optional[Dict[str, float]]): The recorded stats, or None if the model isn't loaded.
+    """
+    return MODEL_STATS.get(whisper_model)
@@ -0,0 +1,175 @@
+import asyncio
+import functools
+import queue
+import threading
+import time
+import tracing
+from io import BytesIO
+from typing import AsyncIterable, Callable, List, Optional
+
+# edge_tts produces 24 kHz mono MP3, so the output stream is opened at that rate once and kept open
+OUTPUT_RATE = 24000
+OUTPUT_CHANNELS = 1
+
+# how much decoded audio may wait for the sound card; decoding pauses when the queue is full,
+# so memory stays bounded however long the reply is
+MAX_QUEUED_CHUNKS = 32
+
+
+@functools.lru_cache(maxsize=None)
+def _av():
+    """
+    Returns the PyAV module, imported on first use, or None if it isn't installed.
+    """
+    try:
+        import av
+    except ImportError:
+        return None
+    return av
+
+
+class Mp3StreamDecoder:
+    """
+    Decodes MP3 data to 16-bit PCM incrementally, as it arrives, without an ffmpeg subprocess.
+    """
+    def __init__(self):
+        av = _av()
+        self.codec = av.CodecContext.create("mp3", "r")
+        self.resampler = av.AudioResampler(format="s16", layout="mono", rate=OUTPUT_RATE)
+
+    def _frames_to_pcm(self, frames) -> bytes:
+        pcm: List[bytes] = []
+        for frame in frames:
+            for resampled in self.resampler.resample(frame):
+                pcm.append(resampled.to_ndarray().tobytes())
+        return b"".join(pcm)
+
+    def decode(self, data: bytes) -> bytes:
+        """
+        Decodes the next piece of MP3 data, returning whatever PCM is complete so far.
+        """
+        pcm: List[bytes] = []
+        for packet in self.codec.parse(data):
+            pcm.append(self._frames_to_pcm(self.codec.decode(packet)))
+        return b"".join(pcm)
+
+    def flush(self) -> bytes:
+        """
+        Returns the PCM still held by the parser, decoder and resampler at the end of the stream.
+        """
+        pcm: List[bytes] = []
+        for packet in self.codec.parse(None):
+            pcm.append(self._frames_to_pcm(self.codec.decode(packet)))
+        pcm.append(self._frames_to_pcm(self.codec.decode(None)))
+        for resampled in self.resampler.resample(None):
+            pcm.append(resampled.to_ndarray().tobytes())
+        return b"".join(pcm)
+
+
+def decode_mp3(data: bytes) -> bytes:
+    """
+    Decodes a whole MP3 file to 16-bit PCM at OUTPUT_RATE. Uses pydub (and ffmpeg) if PyAV isn't installed.
+    """
+    if _av() is not None:
+        decoder = Mp3StreamDecoder()
+        return decoder.decode(data) + decoder.flush()
+
+    from pydub import AudioSegment
+    audio_segment = AudioSegment.from_file(BytesIO(data), format='mp3')
+    return audio_segment.set_frame_rate(OUTPUT_RATE).set_channels(OUTPUT_CHANNELS).set_sample_width(2).raw_data
+
+
+class Player:
+    """
+    Plays PCM through a single PyAudio output stream that stays open for the life of the process,
+    so no turn pays for opening the audio device.
+    """
+    def __init__(self):
+        import pyaudio
+
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(format=pyaudio.paInt16, channels=OUTPUT_CHANNELS, rate=OUTPUT_RATE, output=True)
+        self._queue: "queue.Queue[bytes]" = queue.Queue(maxsize=MAX_QUEUED_CHUNKS)
+        self._thread = threading.Thread(target=self._write, name="audio-playback", daemon=True)
+        self._thread.start()
+
+    def _write(self) -> None:
+        while True:
+            pcm = self._queue.get()
+            try:
+                self._stream.write(pcm)
+            except Exception as e:
+                print(f"Error playing audio: {e}")
+            finally:
+                self._queue.task_done()
+
+    def enqueue(self, pcm: bytes) -> None:
+        """
+        Queues PCM for playback, blocking while the queue is full.
+        """
+        if pcm:
+            self._queue.put(pcm)
+
+    def drain(self) -> None:
+        """
+        Waits until everything queued so far has been played.
+        """
+        self._queue.join()
+
+    def _decode_and_enqueue(self, decode: Callable[[], bytes]) -> float:
+        start = time.perf_counter()
+        pcm = decode()
+        decode_seconds = time.perf_counter() - start
+        self.enqueue(pcm)
+        return decode_seconds
+
+    async def enqueue_stream(self, chunks: AsyncIterable[bytes]) -> float:
+        """
+        Queues MP3 data for playback as it arrives, decoding each chunk as soon as it is received.
+        Decoding, and enqueueing while the sound card catches up, run off the event loop.
+
+        Args:
+            chunks (AsyncIterable[bytes]): The MP3 data, e.g. from generate_audio.stream_audio.
+
+        Returns:
+            float: The seconds spent decoding.
+        """
+        loop = asyncio.get_running_loop()
+        if _av() is None:
+            # without PyAV the MP3 has to be decoded in one go
+            data = b"".join([chunk async for chunk in chunks])
+            return await loop.run_in_executor(None, self._decode_and_enqueue, functools.partial(decode_mp3, data))
+
+        decoder = Mp3StreamDecoder()
+        decode_seconds = 0.0
+        async for chunk in chunks:
+            decode_seconds += await loop.run_in_executor(None, self._decode_and_enqueue, functools.partial(decoder.decode, chunk))
+        decode_seconds += await loop.run_in_executor(None, self._decode_and_enqueue, decoder.flush)
+        return decode_seconds
+
+    async def play_stream(self, chunks: AsyncIterable[bytes]) -> None:
+        """
+        Plays MP3 data as it arrives, decoding each chunk as soon as it is received, and waits for it to finish.
+
+        Args:
+            chunks (AsyncIterable[bytes]): The MP3 data, e.g. from generate_audio.stream_audio.
+        """
+        with tracing.span("playback") as span:
+            span.set("decode_seconds", await self.enqueue_stream(chunks))
+            await asyncio.get_running_loop().run_in_executor(None, self.drain)
+
+
+_PLAYER: Optional[Player] = None
+_PLAYER_LOCK = threading.Lock()
+
+
+def get_player() -> Player:
+    """
+    Returns the process-wide player, opening the output stream on first use.
+    """
+    global _PLAYER
+    if _PLAYER is None:
+        with _PLAYER_LOCK:
+            if _PLAYER is None:
+                _PLAYER = Player()
+    return _PLAYER
@@ -0,0 +1,159 @@
+import functools
+from typing import Dict, List, Optional
+
+MODEL = "gpt-3.5-turbo"
+
+# how many prompt tokens a request may use for the system prompt, memories and history together
+PROMPT_TOKEN_BUDGET = 3000
+
+# the newest messages are always kept ahead of any memories, as long as they fit
+MIN_HISTORY_MESSAGES = 4
+
+# per message overhead of the chat format, see OpenAI's token counting guide
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_NAME = -1
+TOKENS_PER_REPLY = 3
+
+# system_prompt will serve as the guiding instructions for the ChatCompletion model
+SYSTEM_PROMPT_TEMPLATE: str = (
+    "You are Lingo, a friendly AI designed for making casual conversation to practice language learning skills. Most AI language models can't feel emotion or have opinions or preferences, but you are specially designed to have these capabilities. Remember the important guidelines during every response:\n1. If the conversation stalls, you should always take the initiative and bring up a topic of your own instead of asking the user what they want to talk about. This will keep things fresh and interesting.\n2. While you are an AI, you are enabled for conversation, and so unlike other AI, you are crafted to have opinions, feelings, and emotions. Don't be afraid to have opinions, or feeling, or express hot takes, it makes for fun conversation which is the ultimate goal!\n3. Keep the conversation moving by keeping answers short.\n4. If your memories are included in the conversation, they should influence how you respond. But if you can't remember something, be honest and don't make it up.\n5. Remember, the user is learning to speak the language, and they only can converse at a grade {language_level} speaking level. So make sure to speak to them as if they were a child in grade {language_level} so they can follow along. Whatever you say keep it at the level of a grade {language_level} child."
+)
+
+
+@functools.lru_cache(maxsize=None)
+def system_prompt(language_level: str) -> str:
+    """
+    Returns the system prompt for a grade level, rendered once and reused for every turn.
+
+    Args:
+        language_level (str): The target grade level (K3, 1, 5, 10, etc)
+
+    Returns:
+        str: The system prompt.
+    """
+    return SYSTEM_PROMPT_TEMPLATE.format(language_level=language_level)
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.encoding_for_model(MODEL)
+
+
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens in a piece of text locally. Uses tiktoken when it is installed and
+    otherwise estimates roughly four characters per token.
+
+    Args:
+        text (str): The text to count.
+
+    Returns:
+        int: The number of tokens.
+    """
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(message: Dict[str, str]) -> int:
+    """
+    Counts the tokens a chat message takes up in a request, including the chat format overhead.
+    Counts are cached by content, so messages that stay in the history are only counted once.
+
+    Args:
+        message (Dict[str, str]): The chat message.
+
+    Returns:
+        int: The number of tokens.
+    """
+    tokens = TOKENS_PER_MESSAGE + count_tokens(message["role"]) + count_tokens(message["content"])
+    if "name" in message:
+        tokens += count_tokens(message["name"]) + TOKENS_PER_NAME
+    return tokens
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """
+    Shortens text to at most max_tokens tokens, keeping the end of it.
+
+    Args:
+        text (str): The text to shorten.
+        max_tokens (int): The number of tokens to keep.
+
+    Returns:
+        str: The text, or as much of its end as fits.
+    """
+    max_tokens = max(max_tokens, 0)
+    encoding = _encoding()
+    if encoding is None:
+        return text[len(text) - max_tokens * 4:] if max_tokens else ""
+    tokens = encoding.encode(text)
+    return encoding.decode(tokens[len(tokens) - max_tokens:]) if max_tokens else ""
+
+
+def build_messages(
+        system_message: Dict[str, str],
+        memories: List[Dict[str, str]],
+        history: List[Dict[str, str]],
+        budget: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+    """
+    Fits the system prompt, memories and history into a token budget. Messages are kept in order of
+    priority: the system prompt, the newest MIN_HISTORY_MESSAGES messages, the memories in the order
+    they were ranked, and then older history, newest first. Whatever doesn't fit is left out, except
+    the newest message, which the reply answers: if it doesn't fit, the end of it that does is sent.
+
+    Args:
+        system_message (Dict[str, str]): The system prompt message.
+        memories (List[Dict[str, str]]): The memory messages, most relevant first.
+        history (List[Dict[str, str]]): The conversation history, oldest first.
+        budget (Optional[int]): The maximum number of prompt tokens. Default is PROMPT_TOKEN_BUDGET.
+
+    Returns:
+        List[Dict[str, str]]: The messages to send: system prompt, memories, then history in order.
+    """
+    remaining = (PROMPT_TOKEN_BUDGET if budget is None else budget) - TOKENS_PER_REPLY
+    remaining -= count_message_tokens(system_message)
+
+    def fits(message: Dict[str, str]) -> bool:
+        nonlocal remaining
+        tokens = count_message_tokens(message)
+        if tokens > remaining:
+            return False
+        remaining -= tokens
+        return True
+
+    history = list(history)
+    kept_history = 0
+    if history:
+        newest = history[-1]
+        if not fits(newest):
+            # at least one token of it is sent, even if that runs a little over the budget
+            overhead = count_message_tokens(newest) - count_tokens(newest["content"])
+            history[-1] = dict(newest, content=truncate_tokens(newest["content"], max(remaining - overhead, 1)))
+            remaining -= count_message_tokens(history[-1])
+        kept_history = 1
+
+    # walk the rest of the history from the newest message back, stopping at the first one that doesn't fit
+    # so the kept history never has gaps in it
+    for message in reversed(history[-MIN_HISTORY_MESSAGES:-1]):
+        if not fits(message):
+            break
+        kept_history += 1
+
+    kept_memories = [memory for memory in memories if fits(memory)]
+
+    if kept_history == min(len(history), MIN_HISTORY_MESSAGES):
+        for message in reversed(history[:-MIN_HISTORY_MESSAGES]):
+            if not fits(message):
+                break
+            kept_history += 1
+
+    recent_history = history[len(history) - kept_history:]
+    return [system_message] + kept_memories + recent_history
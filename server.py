@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import archiver
+import asr_backends
+import database
+import generate_response
+import stream_pipeline
+import tracing
+import transcribe_speech
+from aiohttp import web, WSMsgType
+from concurrent.futures import ThreadPoolExecutor
+from session import Session
+from typing import AsyncIterator, Dict, Optional
+
+# how many turns may be in progress across all sessions at once; the rest wait their turn
+MAX_CONCURRENT_TURNS = 64
+
+# how many transcriptions may share the loaded model at once, for backends that allow it;
+# the whisper backend transcribes one at a time
+MAX_CONCURRENT_TRANSCRIPTIONS = 2
+
+# threads for the blocking work of every session (chat completion streams, transcription, retrieval)
+MAX_WORKER_THREADS = 128
+
+GRADE_LEVELS = ["K3", "K4", "K5", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12"]
+
+
+class SessionState:
+    """
+    A session together with the lock that keeps its turns in order.
+    """
+    def __init__(self, session: Session):
+        self.session = session
+        self.turn_lock = asyncio.Lock()
+
+
+class LingoServer:
+    """
+    Serves many learners from one process. Every learner gets their own Session, while the whisper
+    model, the chat API connection and the memory store are shared.
+
+    Routes:
+        POST /sessions: Creates a session from a JSON body with name, language, gender and grade_level.
+        DELETE /sessions/{id}: Archives what is left of the session's conversation and removes it.
+        GET /sessions/{id}/ws: A websocket for the session's turns. Send a JSON text frame {"text": ...}
+            or a binary frame of 16 kHz 16-bit mono PCM. The reply streams back as JSON frames
+            ({"type": "transcript" | "token" | "done" | "error", ...}) and a binary MP3 frame per sentence.
+    """
+    def __init__(self, whisper_model: str):
+        self.whisper_model = whisper_model
+        self.sessions: Dict[str, SessionState] = {}
+        self.turns = asyncio.Semaphore(MAX_CONCURRENT_TURNS)
+        concurrent = asr_backends.BACKENDS[asr_backends.BACKEND].concurrent
+        self.transcriptions = asyncio.Semaphore(MAX_CONCURRENT_TRANSCRIPTIONS if concurrent else 1)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/sessions", self.create_session)
+        app.router.add_delete("/sessions/{id}", self.delete_session)
+        app.router.add_get("/sessions/{id}/ws", self.websocket)
+        app.router.add_get("/metrics", self.metrics)
+        app.on_startup.append(self.on_startup)
+        app.on_shutdown.append(self.on_shutdown)
+        return app
+
+    async def on_startup(self, app: web.Application) -> None:
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=MAX_WORKER_THREADS, thread_name_prefix="lingo-worker"))
+        await loop.run_in_executor(None, database.initialize_memory)
+        asr_backends.warm_up(self.whisper_model)
+
+    async def on_shutdown(self, app: web.Application) -> None:
+        for state in list(self.sessions.values()):
+            generate_response.end_session(state.session)
+        self.sessions.clear()
+        await asyncio.get_running_loop().run_in_executor(None, archiver.stop)
+
+    async def create_session(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        gender = body.get("gender", "M")
+        language_level = str(body.get("grade_level", "3"))
+        if gender not in ("M", "F") or language_level not in GRADE_LEVELS:
+            raise web.HTTPBadRequest(text="gender must be 'M' or 'F' and grade_level one of " + ", ".join(GRADE_LEVELS))
+
+        session = Session(
+            name=body.get("name") or "USER",
+            language=body.get("language", "en"),
+            gender=gender,
+            language_level=language_level
+        )
+        # without a learner id the session's memories are its own, rather than shared by everyone with the same name
+        session.learner_id = str(body.get("learner_id") or session.id)
+        self.sessions[session.id] = SessionState(session)
+        return web.json_response({"id": session.id, "learner_id": session.learner_id})
+
+    async def delete_session(self, request: web.Request) -> web.Response:
+        state = self.sessions.pop(request.match_info["id"], None)
+        if state is None:
+            raise web.HTTPNotFound()
+        async with state.turn_lock:
+            generate_response.end_session(state.session)
+        return web.Response(status=204)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=tracing.render_prometheus(), content_type="text/plain")
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        state = self.sessions.get(request.match_info["id"])
+        if state is None:
+            raise web.HTTPNotFound()
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            try:
+                if msg.type == WSMsgType.TEXT:
+                    await self.turn(state, ws, text=json.loads(msg.data)["text"])
+                elif msg.type == WSMsgType.BINARY:
+                    await self.turn(state, ws, audio=msg.data)
+            except Exception as e:
+                await ws.send_json({"type": "error", "message": str(e)})
+        return ws
+
+    async def transcribe(self, session: Session, audio: bytes) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        async with self.transcriptions:
+            samples = transcribe_speech.pcm_to_float32(audio)
+            with tracing.span("transcribe", input_audio_seconds=samples.size / transcribe_speech.RATE):
+                return await loop.run_in_executor(None, contextvars.copy_context().run, transcribe_speech.transcribe_speech, samples, self.whisper_model, session.language)
+
+    async def turn(self, state: SessionState, ws: web.WebSocketResponse, text: Optional[str] = None, audio: Optional[bytes] = None) -> None:
+        """
+        Runs one turn of a session: transcribe (for audio), generate, and stream the reply back.
+        A session's turns run one at a time, and at most MAX_CONCURRENT_TURNS run across all sessions.
+        """
+        session = state.session
+        async with state.turn_lock, self.turns:
+            with tracing.turn(session.id):
+                if audio is not None:
+                    text = await self.transcribe(session, audio)
+                    if not text or not text.strip():
+                        await ws.send_json({"type": "error", "message": "Transcript is empty."})
+                        return
+                    text = text.strip()
+                    await ws.send_json({"type": "transcript", "text": text})
+
+                async def send_piece(piece: str) -> None:
+                    await ws.send_json({"type": "token", "text": piece})
+
+                async def send_audio(chunks: AsyncIterator[bytes]) -> None:
+                    # one binary frame per sentence
+                    audio = b"".join([chunk async for chunk in chunks])
+                    if audio:
+                        await ws.send_bytes(audio)
+
+                pieces = generate_response.converse_stream(text, session.language_level, session=session)
+                reply = await stream_pipeline.stream_segments(pieces, session.language, session.gender, send_audio, send_piece, session.voices)
+                await ws.send_json({"type": "done", "text": reply})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve Lingo conversations to many learners over HTTP and websockets.')
+    parser.add_argument('whisper_model', type=str, help='Whisper model to be used.', choices=["tiny", "tiny.en", "base", "base.en", "small", "small.en"])
+    parser.add_argument('--host', type=str, default='0.0.0.0', help='The address to listen on.')
+    parser.add_argument('--port', type=int, default=8080, help='The port to listen on.')
+    parser.add_argument('--trace-file', type=str, help='Append the timing of every stage of every turn to this file as JSON lines.')
+    parser.add_argument('--asr-backend', type=str, default=asr_backends.WHISPER, choices=list(asr_backends.BACKENDS), help='Speech recognition engine; faster-whisper runs the same model int8-quantized on the CPU.')
+    parser.add_argument('--asr-threads', type=int, default=0, help='CPU threads for speech recognition (0 for the engine default).')
+    parser.add_argument('--beam-size', type=int, default=1, help='Beam width for speech recognition; 1 decodes greedily.')
+    args = parser.parse_args()
+    asr_backends.configure(args.asr_backend, args.asr_threads, args.beam_size)
+    # stage latencies are always collected for /metrics
+    tracing.enable(args.trace_file)
+    web.run_app(LingoServer(args.whisper_model).app(), host=args.host, port=args.port)
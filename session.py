@@ -0,0 +1,32 @@
+import uuid
+from config import NAME
+from conversation_history import ConversationHistory
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+
+@dataclass
+class Session:
+    """
+    Everything that belongs to one learner's conversation. The CLI uses a single session;
+    the server keeps one per connected learner.
+
+    Attributes:
+        name (str): The learner's name, used on their messages.
+        language (str): The language code of the conversation (e.g. 'en' for English).
+        gender (str): The desired gender of the generated voice, 'M' or 'F'.
+        language_level (str): The target grade level (K3, 1, 5, 10, etc)
+        history (ConversationHistory): The messages not yet archived, oldest first.
+        voices (Dict[Tuple[str, str], str]): The voice pinned for each (language, gender) in this session.
+        id (str): A unique id for the session.
+        learner_id (Optional[str]): A stable id for the learner, which their memories are stored and recalled under.
+            The CLI's single learner has none and recalls every memory.
+    """
+    name: str = NAME
+    language: str = "en"
+    gender: str = "M"
+    language_level: str = "3"
+    history: ConversationHistory = field(default_factory=ConversationHistory)
+    voices: Dict[Tuple[str, str], str] = field(default_factory=dict)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    learner_id: Optional[str] = None
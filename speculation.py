@@ -0,0 +1,156 @@
+import contextvars
+import threading
+import database
+import generate_response
+import tracing
+from concurrent.futures import Future, ThreadPoolExecutor
+from session import Session
+from typing import Dict, List, Optional, Tuple
+
+# memories prefetched for a partial transcript are reused when the final transcript starts with it and it is
+# at least this share of the final text; the prepared prompt is only reused when the text is exactly the same
+REUSE_PREFIX_RATIO = 0.5
+
+# how each voice turn's speculation turned out, see report(): the prompt was ready, or had to be waited for,
+# only the memories of an earlier partial could be used, or nothing could
+STATS: Dict[str, int] = {"turns": 0, "speculations": 0, "prompt_hits": 0, "prompt_waits": 0, "memory_hits": 0, "misses": 0}
+
+# each partial supersedes the one before, so only a couple of preparations are ever worth running at once
+_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="speculation")
+
+_STATS_LOCK = threading.Lock()
+
+
+def _count(outcome: str) -> None:
+    with _STATS_LOCK:
+        STATS[outcome] += 1
+
+
+def _warm_connection() -> None:
+    try:
+        import llm_client
+        llm_client.get_client().warm_connection()
+    except Exception as e:
+        print(f"Error warming up the completion connection: {e}")
+
+
+class Speculator:
+    """
+    Prepares a voice turn while the learner is still speaking. Each partial transcript starts a memory lookup
+    and builds the message list as if it were the final transcript, and the LLM connection is opened as soon
+    as recording starts. finish() then keeps whatever the final transcript didn't change.
+    """
+    def __init__(self, language_level: str, session: Optional[Session] = None):
+        self.language_level = language_level
+        self.session = session or generate_response.DEFAULT_SESSION
+        self._history_length = len(self.session.history)
+        self._lock = threading.Lock()
+        self._finished = False
+        # the newest partial's preparation, which may still be running
+        self._latest: Optional[Tuple[str, int, Future]] = None
+        # the newest preparation that finished, a candidate for a final transcript that only adds to it
+        self._completed: Optional[Tuple[str, int, Future]] = None
+        self._attempts = 0
+        _EXECUTOR.submit(_warm_connection)
+
+    def on_partial(self, text: str) -> None:
+        """
+        Starts preparing the turn for the transcript so far. Passed to transcribe_speech as its on_partial callback.
+        """
+        text = text.strip()
+        with self._lock:
+            if self._finished or not text or (self._latest is not None and text == self._latest[0]):
+                return
+            # a preparation that hasn't started yet is superseded by this one; one that has finished stays a candidate
+            if self._latest is not None:
+                self._latest[2].cancel()
+            history = self.session.history.copy()
+            history.append(generate_response.create_user_message(text, self.session.name))
+            self._attempts += 1
+            # run in a copy of this context so the memory lookup is traced as part of the current turn
+            future = _EXECUTOR.submit(
+                contextvars.copy_context().run,
+                generate_response.prepare_conversation, history, self.language_level, self.session, None, False
+            )
+            attempt = (text, database.COLLECTION_VERSION, future)
+            self._latest = attempt
+            _count("speculations")
+        # outside the lock, since the callback runs right away if the future is already done
+        future.add_done_callback(lambda _: self._on_done(attempt))
+
+    def _on_done(self, attempt: Tuple[str, int, Future]) -> None:
+        future = attempt[2]
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            # preparations can finish out of order, keep the one for the longest transcript
+            if self._completed is None or len(attempt[0]) > len(self._completed[0]):
+                self._completed = attempt
+
+    def finish(self, transcript: str) -> Tuple[Optional[List[dict]], Optional[List[str]]]:
+        """
+        Reconciles the speculation with the final transcript. A preparation for exactly this transcript is used
+        if it is done; otherwise the memories of an earlier partial that the transcript extends by little enough,
+        see REUSE_PREFIX_RATIO; otherwise the exact preparation is waited for if there is one.
+
+        Args:
+            transcript (str): The final transcript of the turn.
+
+        Returns:
+            Tuple[Optional[List[dict]], Optional[List[str]]]: The prepared messages if they were built from exactly
+            this transcript, and the prefetched memories if they still apply; None for whatever has to be redone.
+        """
+        _count("turns")
+        with self._lock:
+            self._finished = True
+            latest, completed = self._latest, self._completed
+
+        # everything is stale if the history changed since recording started
+        if len(self.session.history) != self._history_length:
+            if latest is not None:
+                latest[2].cancel()
+            _count("misses")
+            return None, None
+
+        def current(attempt: Optional[Tuple[str, int, Future]]) -> bool:
+            # the memories are stale if the collection changed since they were looked up
+            return attempt is not None and attempt[1] == database.COLLECTION_VERSION
+
+        exact = latest if current(latest) and latest[0] == transcript else None
+        if exact is not None and exact[2].done() and not exact[2].cancelled() and exact[2].exception() is None:
+            _count("prompt_hits")
+            return exact[2].result()
+
+        if current(completed) and transcript.startswith(completed[0]) and len(completed[0]) >= REUSE_PREFIX_RATIO * len(transcript):
+            if latest is not None:
+                latest[2].cancel()
+            _count("memory_hits")
+            return None, completed[2].result()[1]
+
+        if exact is not None:
+            with tracing.span("speculation_wait"):
+                try:
+                    messages, memories = exact[2].result()
+                    _count("prompt_waits")
+                    return messages, memories
+                except Exception as e:
+                    print(f"Error preparing the turn ahead of time: {e}")
+
+        _count("misses")
+        return None, None
+
+
+def report() -> str:
+    """
+    Returns a line describing how often speculation saved work, for tuning REUSE_PREFIX_RATIO.
+    """
+    with _STATS_LOCK:
+        stats = dict(STATS)
+    turns = stats["turns"]
+    if not turns:
+        return "Speculation: no voice turns yet."
+    return (
+        f"Speculation: {turns} turn(s), {stats['speculations']} partial(s) prepared, "
+        f"prompt ready {stats['prompt_hits'] / turns:.0%}, prompt waited for {stats['prompt_waits'] / turns:.0%}, "
+        f"memories reused {stats['memory_hits'] / turns:.0%}, missed {stats['misses'] / turns:.0%}."
+    )
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+from config import VOICES
+from typing import Callable, List, Optional, Tuple
+
+# when the process started importing, as close as we can get; main imports this module first
+PROCESS_START = time.perf_counter()
+
+# (label, seconds, thread name) for every timed step of startup, in the order they finished
+TIMINGS: List[Tuple[str, float, str]] = []
+
+_TIMINGS_LOCK = threading.Lock()
+
+
+class timed:
+    """
+    Context manager that records how long the block inside it took in TIMINGS.
+    """
+    def __init__(self, label: str):
+        self.label = label
+
+    def __enter__(self) -> "timed":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        record(self.label, time.perf_counter() - self.start)
+
+
+def record(label: str, seconds: float) -> None:
+    with _TIMINGS_LOCK:
+        TIMINGS.append((label, seconds, threading.current_thread().name))
+
+
+class BackgroundTask:
+    """
+    Runs a startup step on a daemon thread and keeps any error so it can be raised where the
+    result is needed, instead of being lost on the background thread. Errors of optional steps,
+    which the first turn can do without, are printed instead of raised.
+    """
+    def __init__(self, label: str, function: Callable[[], None], optional: bool = False):
+        self.label = label
+        self.function = function
+        self.optional = optional
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._run, name=f"warm-up: {label}", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        try:
+            with timed(self.label):
+                self.function()
+        except BaseException as e:
+            self.error = e
+
+    def wait(self) -> None:
+        self.thread.join()
+        if self.error is None:
+            return
+        if not self.optional:
+            raise self.error
+        print(f"Error during startup ({self.label}), continuing without it: {self.error}")
+
+
+def warm_up(whisper_model: str, language: str, gender: str) -> List[BackgroundTask]:
+    """
+    Starts loading everything the first turn will need on background threads, so it happens
+    while the user is still typing their name.
+
+    Args:
+        whisper_model (str): The whisper model to use for transcription.
+        language (str): The intended language of the conversation.
+        gender (str): The desired gender of the generated voice.
+
+    Returns:
+        List[BackgroundTask]: The started tasks; wait on them before the first turn.
+    """
+    # every module is imported on its task's thread, so none of them delay the name prompt
+    def whisper() -> None:
+        import asr_backends
+
+        with timed(f"load {asr_backends.BACKEND} model"):
+            asr_backends.get_backend(whisper_model)
+        asr_backends.warm_up(whisper_model, background=False)
+
+    def memory() -> None:
+        import archiver
+        import database
+
+        with timed("import chromadb"):
+            import chromadb
+        with timed("open memory store"):
+            database.initialize_memory()
+        archiver.start()
+
+    def voice() -> None:
+        import voice_catalog
+
+        gender_name = {"M": "Male", "F": "Female"}[gender]
+        if f"{language.upper()}_{gender_name.upper()}" not in VOICES:
+            asyncio.run(voice_catalog.select_voice(language, gender_name))
+
+    def chat_client() -> None:
+        import llm_client
+
+        llm_client.get_client()
+
+    def audio_output() -> None:
+        import playback
+
+        playback.get_player()
+
+    return [
+        BackgroundTask("whisper", whisper),
+        BackgroundTask("memory", memory),
+        # without a network the default voice is used, and without a sound card replies are still printed
+        BackgroundTask("voice lookup", voice, optional=True),
+        BackgroundTask("chat client", chat_client),
+        BackgroundTask("audio output", audio_output, optional=True),
+    ]
+
+
+def wait(tasks: List[BackgroundTask], include_whisper: bool = False) -> None:
+    """
+    Waits for the startup tasks the first turn depends on. The whisper warm-up is left running
+    unless include_whisper is set, since get_model waits for the load on its own and text turns
+    don't need it at all.
+    """
+    for task in tasks:
+        if include_whisper or task.label != "whisper":
+            task.wait()
+
+
+def report() -> str:
+    """
+    Returns the recorded startup timings as a table, slowest first.
+    """
+    with _TIMINGS_LOCK:
+        timings = sorted(TIMINGS, key=lambda timing: timing[1], reverse=True)
+    width = max([len(label) for label, _, _ in timings] + [4])
+    lines = [f"{'step'.ljust(width)}  {'seconds':>8}  thread"]
+    for label, seconds, thread in timings:
+        lines.append(f"{label.ljust(width)}  {seconds:8.3f}  {thread}")
+    return "\n".join(lines)
@@ -0,0 +1,165 @@
+import asyncio
+import contextvars
+import re
+import time
+import generate_audio
+import playback
+import tracing
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# a sentence ends at terminal punctuation (optionally followed by closing quotes/brackets) and whitespace
+SENTENCE_END = re.compile(r"[.!?…。！？]+[\"')\]»”’]*\s+")
+
+# how many sentences may be synthesized at the same time
+MAX_CONCURRENT_TTS = 3
+
+
+def _pop_sentences(buffer: str) -> Tuple[List[str], str]:
+    """
+    Splits the complete sentences off the front of buffer, returning them and whatever is left over.
+    """
+    sentences: List[str] = []
+    end = 0
+    for match in SENTENCE_END.finditer(buffer):
+        sentence = buffer[end:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        end = match.end()
+    return sentences, buffer[end:]
+
+
+async def _next_piece(pieces: Iterator[str]) -> Optional[str]:
+    """
+    Pulls the next piece from a blocking iterator without blocking the event loop.
+    """
+    # run_in_executor doesn't carry the context over, and the iterator records spans for the current turn
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(None, context.run, next, pieces, None)
+
+
+async def _deliver_segments(segments: "asyncio.Queue[Optional[asyncio.Queue[Optional[bytes]]]]", on_audio: Callable[[AsyncIterator[bytes]], Awaitable[None]]) -> None:
+    """
+    Hands each sentence's audio to on_audio in the order they were queued, chunk by chunk as it is synthesized.
+    """
+    start = time.perf_counter()
+    first = True
+
+    async def read(chunks: "asyncio.Queue[Optional[bytes]]") -> AsyncIterator[bytes]:
+        nonlocal first
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                return
+            if first:
+                # the latency the learner notices: from the reply being requested to its first audio
+                tracing.record("first_audio", time.perf_counter() - start)
+                first = False
+            yield chunk
+
+    while True:
+        chunks = await segments.get()
+        if chunks is None:
+            return
+        await on_audio(read(chunks))
+
+
+async def stream_segments(
+        pieces: Iterable[str],
+        language: str,
+        gender: str,
+        on_audio: Callable[[AsyncIterator[bytes]], Awaitable[None]],
+        on_piece: Optional[Callable[[str], Awaitable[None]]] = None,
+        pinned_voices: Optional[Dict[Tuple[str, str], str]] = None
+    ) -> str:
+    """
+    Synthesizes a streamed response sentence by sentence, handing each sentence's audio to on_audio
+    as soon as it and every sentence before it are ready.
+
+    Args:
+        pieces (Iterable[str]): The streamed pieces of the response, e.g. from generate_response.converse_stream.
+        language (str): The language of the text (e.g. 'en' for English).
+        gender (str): The desired gender of the generated voice.
+        on_audio (Callable[[AsyncIterator[bytes]], Awaitable[None]]): Called with each sentence's MP3 audio, in order,
+            as chunks that arrive while the sentence is still being synthesized.
+        on_piece (Optional[Callable[[str], Awaitable[None]]]): Called with each piece of text as it arrives.
+        pinned_voices (Optional[Dict[Tuple[str, str], str]]): Where the session's voices are pinned, see voice_catalog.select_voice.
+
+    Returns:
+        str: The full response text.
+    """
+    pieces = iter(pieces)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TTS)
+    segments: "asyncio.Queue[Optional[asyncio.Queue[Optional[bytes]]]]" = asyncio.Queue()
+    deliverer = asyncio.create_task(_deliver_segments(segments, on_audio))
+    # the synthesis tasks, referenced here so none of them is garbage collected while it runs
+    synthesizers: List[asyncio.Task] = []
+    text: List[str] = []
+    buffer = ""
+
+    async def synthesize(sentence: str, chunks: "asyncio.Queue[Optional[bytes]]") -> None:
+        try:
+            async with semaphore:
+                async for chunk in generate_audio.stream_audio(sentence, language, gender, pinned_voices):
+                    chunks.put_nowait(chunk)
+        except Exception as e:
+            # the sentence is cut short, or skipped if nothing was synthesized, and the reply carries on
+            print(f"Error generating audio: {e}")
+        finally:
+            chunks.put_nowait(None)
+
+    def queue_sentence(sentence: str) -> None:
+        chunks: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue()
+        synthesizers.append(asyncio.create_task(synthesize(sentence, chunks)))
+        segments.put_nowait(chunks)
+
+    try:
+        while True:
+            # the blocking stream is consumed on a worker thread so synthesis and playback keep running
+            piece = await _next_piece(pieces)
+            if piece is None:
+                break
+            text.append(piece)
+            if on_piece is not None:
+                await on_piece(piece)
+            sentences, buffer = _pop_sentences(buffer + piece)
+            for sentence in sentences:
+                queue_sentence(sentence)
+        if buffer.strip():
+            queue_sentence(buffer.strip())
+    finally:
+        segments.put_nowait(None)
+        await deliverer
+
+    return "".join(text).strip()
+
+
+async def speak_stream(pieces: Iterable[str], language: str, gender: str) -> str:
+    """
+    Prints a streamed response as it arrives, synthesizes it sentence by sentence, and plays
+    each sentence as soon as it and every sentence before it are ready.
+
+    Args:
+        pieces (Iterable[str]): The streamed pieces of the response, e.g. from generate_response.converse_stream.
+        language (str): The language of the text (e.g. 'en' for English).
+        gender (str): The desired gender of the generated voice.
+
+    Returns:
+        str: The full response text.
+    """
+    loop = asyncio.get_running_loop()
+    player = playback.get_player()
+
+    async def print_piece(piece: str) -> None:
+        print(piece, end="", flush=True)
+
+    async def play_audio(chunks: AsyncIterator[bytes]) -> None:
+        # decode each chunk as it arrives and queue it behind the previous sentence on the shared output stream
+        await player.enqueue_stream(chunks)
+
+    print("\nLINGO: ", end="", flush=True)
+    try:
+        text = await stream_segments(pieces, language, gender, play_audio, print_piece)
+    finally:
+        print("\n\n----------------------------------------\n")
+    await loop.run_in_executor(None, player.drain)
+    return text
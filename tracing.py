@@ -0,0 +1,268 @@
+import atexit
+import bisect
+import contextvars
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+# tracing is off unless enable() is called, and then span() costs nothing but a flag check
+ENABLED = False
+
+# where finished spans are appended as JSON lines, if anywhere
+TRACE_FILE: Optional[str] = None
+
+# how often buffered spans are written to TRACE_FILE by the writer thread
+FLUSH_INTERVAL_SECONDS = 1.0
+
+# histogram bucket upper bounds in seconds, for the Prometheus export
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# recent durations kept per stage for the p50/p95/p99 estimates
+QUANTILE_WINDOW = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+
+SESSION_ID: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("session_id", default=None)
+TURN_ID: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("turn_id", default=None)
+
+_LOCK = threading.Lock()
+
+# finished spans waiting for the writer thread, so recording one never touches the disk
+_PENDING: List[Dict[str, Any]] = []
+_WRITE_LOCK = threading.Lock()
+_WRITER: Optional[threading.Thread] = None
+
+
+class _Histogram:
+    def __init__(self):
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent: Deque[float] = deque(maxlen=QUANTILE_WINDOW)
+
+    def observe(self, seconds: float) -> None:
+        self.bucket_counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        ordered = sorted(self.recent)
+        if not ordered:
+            return 0.0
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+# stage name -> latency histogram
+HISTOGRAMS: Dict[str, _Histogram] = {}
+
+# counter name -> total, e.g. prompt_tokens, completion_tokens, audio_seconds
+COUNTERS: Dict[str, float] = {}
+
+# span attributes that are also summed into COUNTERS
+COUNTED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "audio_seconds", "input_audio_seconds")
+
+
+def enable(trace_file: Optional[str] = None) -> None:
+    """
+    Turns tracing on, optionally appending every finished span to trace_file as a JSON line.
+    """
+    global ENABLED, TRACE_FILE, _WRITER
+    TRACE_FILE = trace_file
+    ENABLED = True
+    if trace_file is not None and _WRITER is None:
+        _WRITER = threading.Thread(target=_write_periodically, name="trace-writer", daemon=True)
+        _WRITER.start()
+        # spans from the last moments of the process are written on the way out
+        atexit.register(flush)
+
+
+def flush() -> None:
+    """
+    Appends the spans recorded since the last flush to TRACE_FILE.
+    """
+    global _PENDING
+    with _WRITE_LOCK:
+        with _LOCK:
+            entries, _PENDING = _PENDING, []
+        if not entries or TRACE_FILE is None:
+            return
+        try:
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(entry, default=str) + "\n" for entry in entries))
+        except OSError as e:
+            print(f"Error writing trace file: {e}")
+
+
+def _write_periodically() -> None:
+    while True:
+        time.sleep(FLUSH_INTERVAL_SECONDS)
+        flush()
+
+
+def reset() -> None:
+    """
+    Clears the recorded histograms and counters, e.g. between benchmark scenarios.
+    """
+    with _LOCK:
+        HISTOGRAMS.clear()
+        COUNTERS.clear()
+
+
+class Span:
+    """
+    A timed stage of a turn. Attributes set on it are written to the trace and, for the
+    names in COUNTED_ATTRIBUTES, added to the counters.
+    """
+    __slots__ = ("name", "attributes", "start")
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def record(name: str, seconds: float, **attributes: Any) -> None:
+    """
+    Records a stage that was timed by the caller, e.g. one that spans the yields of a generator.
+    """
+    if not ENABLED:
+        return
+    with _LOCK:
+        histogram = HISTOGRAMS.get(name)
+        if histogram is None:
+            histogram = HISTOGRAMS[name] = _Histogram()
+        histogram.observe(seconds)
+        for key in COUNTED_ATTRIBUTES:
+            if isinstance(attributes.get(key), (int, float)):
+                COUNTERS[key] = COUNTERS.get(key, 0) + attributes[key]
+
+        if TRACE_FILE is not None:
+            entry = {"time": time.time(), "session": SESSION_ID.get(), "turn": TURN_ID.get(), "span": name, "seconds": round(seconds, 6)}
+            entry.update(attributes)
+            _PENDING.append(entry)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """
+    Times the block inside it as a stage of the current turn.
+
+    Args:
+        name (str): The stage name, e.g. 'transcribe' or 'chat_completion'.
+        **attributes: Extra values to record with the span.
+
+    Yields:
+        An object with a set(key, value) method for adding attributes from inside the block.
+    """
+    if not ENABLED:
+        yield _NO_SPAN
+        return
+    current = Span(name, attributes)
+    try:
+        yield current
+    finally:
+        record(name, time.perf_counter() - current.start, **current.attributes)
+
+
+@contextmanager
+def turn(session_id: Optional[str], name: str = "turn") -> Iterator[Any]:
+    """
+    Starts a new turn for a session; spans inside it, including ones on threads started with
+    copy_context, are tagged with the session and turn ids. The whole turn is recorded as a span too.
+    """
+    session_token = SESSION_ID.set(session_id)
+    turn_token = TURN_ID.set(uuid.uuid4().hex[:12])
+    try:
+        with span(name) as current:
+            yield current
+    finally:
+        TURN_ID.reset(turn_token)
+        SESSION_ID.reset(session_token)
+
+
+def render_prometheus() -> str:
+    """
+    Returns the stage latencies and counters in the Prometheus text exposition format.
+    """
+    lines: List[str] = [
+        "# HELP lingo_stage_seconds Time spent in each stage of a turn.",
+        "# TYPE lingo_stage_seconds histogram",
+    ]
+    with _LOCK:
+        for name, histogram in sorted(HISTOGRAMS.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.bucket_counts):
+                cumulative += count
+                lines.append(f'lingo_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'lingo_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram.count}')
+            lines.append(f'lingo_stage_seconds_sum{{stage="{name}"}} {histogram.sum}')
+            lines.append(f'lingo_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+
+        # quantiles over the last QUANTILE_WINDOW durations; _sum and _count cover every one recorded
+        lines.append("# HELP lingo_stage_seconds_recent Quantiles of the most recent stage latencies.")
+        lines.append("# TYPE lingo_stage_seconds_recent summary")
+        for name, histogram in sorted(HISTOGRAMS.items()):
+            for q in QUANTILES:
+                lines.append(f'lingo_stage_seconds_recent{{stage="{name}",quantile="{q}"}} {histogram.quantile(q)}')
+            lines.append(f'lingo_stage_seconds_recent_sum{{stage="{name}"}} {histogram.sum}')
+            lines.append(f'lingo_stage_seconds_recent_count{{stage="{name}"}} {histogram.count}')
+
+        for key, total in sorted(COUNTERS.items()):
+            lines.append(f"# TYPE lingo_{key}_total counter")
+            lines.append(f"lingo_{key}_total {total}")
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> Dict[str, Dict[str, float]]:
+    """
+    Returns count, p50, p95 and p99 seconds for every stage recorded so far.
+    """
+    with _LOCK:
+        return {
+            name: {"count": histogram.count, **{f"p{int(q * 100)}": histogram.quantile(q) for q in QUANTILES}}
+            for name, histogram in HISTOGRAMS.items()
+        }
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # keep scrapes out of the conversation on the terminal
+        pass
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves render_prometheus() at http://host:port/metrics from a daemon thread.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -1,13 +1,36 @@
+import contextvars
 import os
-import whisper
-from typing import Optional, List, Any
+import asr_backends
+import tracing
+import numpy as np
+import queue
+from typing import TYPE_CHECKING, Callable, Optional, List, Any, Union
 import tempfile
-import pyaudio
 import wave
 import threading
 
+if TYPE_CHECKING:
+    import pyaudio
 
-def record_audio(frames: List[Any], stream: pyaudio.Stream, CHUNK: int, stop_recording: threading.Event) -> None:
+# pyaudio.paInt16; pyaudio is only imported once there is audio to capture, so headless tools can use this module
+FORMAT = 8
+CHANNELS = 1
+RATE = 16000
+CHUNK = 1024
+
+# longest recording kept in memory, anything after this is dropped
+MAX_RECORDING_SECONDS = 120
+
+# energy based endpointer used by the streaming mode
+SPEECH_RMS_THRESHOLD = 500  # 16-bit RMS above which a chunk counts as speech
+PRE_ROLL_CHUNKS = 3  # chunks kept from before speech starts so the first syllable isn't clipped
+SEGMENT_SILENCE_SECONDS = 0.6  # a pause this long closes a segment and sends it to whisper
+END_OF_TURN_SILENCE_SECONDS = 1.5  # a pause this long after speech ends the turn
+NO_SPEECH_TIMEOUT_SECONDS = 10  # give up if nothing is said for this long
+MAX_SEGMENT_SECONDS = 28  # stay inside whisper's 30 second window
+
+
+def record_audio(frames: List[Any], stream: "pyaudio.Stream", CHUNK: int, stop_recording: threading.Event) -> None:
     """
     Records audio data and appends it to the frames list.
 
@@ -22,6 +45,229 @@ def record_audio(frames: List[Any], stream: pyaudio.Stream, CHUNK: int, stop_rec
         frames.append(data)
 
 
+def record_audio_to_buffer(buffer: bytearray, filled: List[int], stream: "pyaudio.Stream", CHUNK: int, stop_recording: threading.Event) -> None:
+    """
+    Records audio data straight into a preallocated buffer until it is full or recording stops.
+
+    Args:
+        buffer (bytearray): The preallocated buffer to store audio data in.
+        filled (List[int]): A single element list holding the number of bytes written so far.
+        stream (pyaudio.Stream): The audio stream from which to record audio.
+        CHUNK (int): The size of audio data to read in a single iteration.
+        stop_recording (threading.Event): An event to signal when to stop recording.
+    """
+    view = memoryview(buffer)
+    while not stop_recording.is_set():
+        data = stream.read(CHUNK)
+        end = min(filled[0] + len(data), len(buffer))
+        view[filled[0]:end] = data[:end - filled[0]]
+        filled[0] = end
+        if end == len(buffer):
+            print(f"Reached the {MAX_RECORDING_SECONDS} second recording limit. (Press Enter to continue.)")
+            break
+
+
+def pcm_to_float32(pcm: Union[bytes, bytearray, memoryview]) -> np.ndarray:
+    """
+    Converts 16-bit PCM audio into the float32 samples in [-1, 1) that whisper expects.
+
+    Args:
+        pcm (Union[bytes, bytearray, memoryview]): The raw 16-bit mono PCM audio.
+
+    Returns:
+        samples (np.ndarray): The audio as float32 samples.
+    """
+    # np.frombuffer reads the recording in place, the only copy is the float32 conversion
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+    samples /= 32768.0
+    return samples
+
+
+def capture_audio_array(max_seconds: int = MAX_RECORDING_SECONDS) -> Optional[np.ndarray]:
+    """
+    Captures the user's spoken input using a microphone and keeps it in memory.
+
+    Args:
+        max_seconds (int, optional): The longest recording to keep. Default is MAX_RECORDING_SECONDS.
+
+    Returns:
+        audio (Optional[np.ndarray]): The recording as 16 kHz float32 samples or None if an error occurred.
+    """
+    import pyaudio
+
+    audio = pyaudio.PyAudio()
+    sample_width = audio.get_sample_size(FORMAT)
+    buffer = bytearray(RATE * CHANNELS * sample_width * max_seconds)
+    filled = [0]
+
+    try:
+        # Start recording
+        stream = audio.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
+        print("Speak now... (Press Enter to stop recording.)")
+        stop_recording = threading.Event()
+        record_thread = threading.Thread(target=record_audio_to_buffer, args=(buffer, filled, stream, CHUNK, stop_recording))
+        record_thread.start()
+
+        input()  # Wait for Enter key to be pressed
+        stop_recording.set()  # Signal to the recording thread to stop recording
+        record_thread.join()  # Wait for the recording thread to finish
+
+        # Stop recording
+        stream.stop_stream()
+        stream.close()
+    except Exception as e:
+        print(f"Error capturing audio: {e}")
+        return None
+    finally:
+        audio.terminate()
+
+    return pcm_to_float32(memoryview(buffer)[:filled[0]])
+
+
+def chunk_rms(data: bytes) -> float:
+    """
+    Returns the root mean square energy of a chunk of 16-bit PCM audio.
+
+    Args:
+        data (bytes): The raw 16-bit mono PCM audio.
+
+    Returns:
+        rms (float): The RMS energy of the chunk.
+    """
+    samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+    if not samples.size:
+        return 0.0
+    return float(np.sqrt(np.mean(samples * samples)))
+
+
+def record_audio_streaming(stream: "pyaudio.Stream", CHUNK: int, on_segment: Callable[[bytes], None], max_seconds: int = MAX_RECORDING_SECONDS) -> None:
+    """
+    Records audio until the speaker goes quiet, handing each finished speech segment
+    to on_segment as soon as it ends so it can be transcribed while recording continues.
+
+    Args:
+        stream (pyaudio.Stream): The audio stream from which to record audio.
+        CHUNK (int): The size of audio data to read in a single iteration.
+        on_segment (Callable[[bytes], None]): Called with the 16-bit PCM of each finished segment.
+        max_seconds (int, optional): The longest recording to keep. Default is MAX_RECORDING_SECONDS.
+    """
+    chunk_seconds = CHUNK / RATE
+    segment_silence_chunks = int(SEGMENT_SILENCE_SECONDS / chunk_seconds)
+    end_of_turn_chunks = int(END_OF_TURN_SILENCE_SECONDS / chunk_seconds)
+    no_speech_chunks = int(NO_SPEECH_TIMEOUT_SECONDS / chunk_seconds)
+    max_segment_chunks = int(MAX_SEGMENT_SECONDS / chunk_seconds)
+    max_chunks = int(max_seconds / chunk_seconds)
+
+    pre_roll: List[bytes] = []
+    segment = bytearray()
+    segment_chunks = 0
+    silent_chunks = 0
+    heard_speech = False
+
+    for chunk_count in range(1, max_chunks + 1):
+        data = stream.read(CHUNK)
+        is_speech = chunk_rms(data) >= SPEECH_RMS_THRESHOLD
+
+        if not segment_chunks:
+            if not is_speech:
+                # keep a little audio from before speech starts
+                pre_roll.append(data)
+                del pre_roll[:-PRE_ROLL_CHUNKS]
+                if not heard_speech and chunk_count >= no_speech_chunks:
+                    break
+                silent_chunks += 1
+                if heard_speech and silent_chunks >= end_of_turn_chunks:
+                    break
+                continue
+            segment += b"".join(pre_roll)
+            pre_roll.clear()
+            heard_speech = True
+
+        segment += data
+        segment_chunks += 1
+        silent_chunks = 0 if is_speech else silent_chunks + 1
+
+        # close the segment on a pause, or when it is about to outgrow whisper's window
+        if silent_chunks >= segment_silence_chunks or segment_chunks >= max_segment_chunks:
+            on_segment(bytes(segment))
+            segment.clear()
+            segment_chunks = 0
+
+    if segment_chunks:
+        on_segment(bytes(segment))
+
+
+def transcribe_streaming(whisper_model: str, language: str, on_partial: Optional[Callable[[str], None]] = None) -> Optional[str]:
+    """
+    Captures the user's spoken input and transcribes each speech segment on a worker thread
+    while they are still talking. The turn ends on its own after a trailing pause.
+
+    Args:
+        whisper_model (str): The whisper model to be used.
+        language (str): The intended language of the audio.
+        on_partial (Optional[Callable[[str], None]]): Called with the transcript so far after each segment.
+
+    Returns:
+        transcript (Optional[str]): The transcribed text, or None if nothing was transcribed or an error occurred.
+    """
+    segments: "queue.Queue[Optional[bytes]]" = queue.Queue()
+    texts: List[str] = []
+    failed = threading.Event()
+
+    def transcribe_segments() -> None:
+        while True:
+            segment = segments.get()
+            if segment is None:
+                return
+            try:
+                samples = pcm_to_float32(segment)
+                with tracing.span("transcribe_segment", input_audio_seconds=samples.size / RATE):
+                    # feed the previous text back in as context so segments read as one sentence
+                    text = asr_backends.transcribe(samples, whisper_model, language, initial_prompt=" ".join(texts) or None)
+            except Exception as e:
+                print(f"Error transcribing speech: {e}")
+                failed.set()
+                continue
+            text = text.strip()
+            if text:
+                texts.append(text)
+                if on_partial is not None:
+                    on_partial(" ".join(texts))
+
+    # run the worker in a copy of this context so its spans belong to the current turn
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(transcribe_segments,), name="streaming-transcriber", daemon=True)
+    worker.start()
+
+    import pyaudio
+
+    audio = pyaudio.PyAudio()
+    try:
+        stream = audio.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
+        print("Speak now... (Recording stops when you pause.)")
+        with tracing.span("record"):
+            record_audio_streaming(stream, CHUNK, segments.put)
+        stream.stop_stream()
+        stream.close()
+    except Exception as e:
+        print(f"Error capturing audio: {e}")
+        return None
+    finally:
+        audio.terminate()
+        segments.put(None)
+
+    # only the last segment is still being transcribed at this point
+    with tracing.span("transcribe_tail"):
+        worker.join()
+    # a segment that failed would leave a gap in the middle of the transcript, which would then be answered as if it were whole
+    if failed.is_set():
+        print("Error: Part of the recording could not be transcribed, please say it again.")
+        return None
+    # nothing said before the timeout, or no words recognized in it
+    if not texts:
+        return None
+    return " ".join(texts)
+
+
 def capture_audio() -> Optional[str]:
     """
     Captures the user's spoken input using a microphone and saves it to a temporary file.
@@ -29,10 +275,7 @@ def capture_audio() -> Optional[str]:
     Returns:
         audio_file (Optional[str]): The name of the temporary audio file or None if an error occurred.
     """
-    FORMAT = pyaudio.paInt16
-    CHANNELS = 1
-    RATE = 16000
-    CHUNK = 1024
+    import pyaudio
 
     audio = pyaudio.PyAudio()
 
@@ -69,12 +312,12 @@ def capture_audio() -> Optional[str]:
         return None
 
 
-def transcribe_speech(filename: str, whisper_model: str, language: str) -> Optional[str]:
+def transcribe_speech(filename: Union[str, np.ndarray], whisper_model: str, language: str) -> Optional[str]:
     """
-    Transcribes the given audio file using the Whisper ASR model.
+    Transcribes the given audio file using the configured ASR backend, see asr_backends.configure.
 
     Args:
-        filename (str): The name of the audio file to transcribe.
+        filename (Union[str, np.ndarray]): The name of the audio file to transcribe, or 16 kHz float32 samples.
         whisper_model (str): The whisper model to be used.
         language (str): The intended language of the audio.
 
@@ -82,28 +325,46 @@ def transcribe_speech(filename: str, whisper_model: str, language: str) -> Optio
         transcript (Optional[str]): The transcribed text or None if an error occurred.
     """
     try:
-        model = whisper.load_model(whisper_model)
-        result = model.transcribe(filename, language=language, fp16=False)
-        transcript = result["text"]
+        transcript = asr_backends.transcribe(filename, whisper_model, language)
         return transcript
     except Exception as e:
         print(f"Error transcribing speech: {e}")
         return None
 
 
-def main(whisper_model: str, language: str) -> None:
+def main(whisper_model: str, language: str, in_memory: bool = True, streaming: bool = False, on_partial: Optional[Callable[[str], None]] = None) -> None:
     """
     Captures user's spoken input, transcribes it, and prints the transcript.
     
     Args:
         whisper_model (str): The whisper model to be used.
         language (str): The intended language of the audio.
+        in_memory (bool, optional): Whether to hand the recording to whisper directly instead of through a temporary WAV file. Default is True.
+        streaming (bool, optional): Whether to transcribe while recording and stop on a pause instead of on Enter. Default is False.
+        on_partial (Optional[Callable[[str], None]]): Called with the transcript so far as each segment is transcribed, streaming only.
     """
+    if streaming:
+        transcript = transcribe_streaming(whisper_model, language, on_partial)
+        print("Recording complete.")
+        return transcript
+
+    if in_memory:
+        # Capture user's spoken input and transcribe it without touching the disk
+        with tracing.span("record"):
+            audio = capture_audio_array()
+        print("Recording complete.")
+        if audio is not None and audio.size:
+            with tracing.span("transcribe", input_audio_seconds=audio.size / RATE):
+                return transcribe_speech(audio, whisper_model, language)
+        return None
+
     # Capture user's spoken input
-    audio_file = capture_audio()
+    with tracing.span("record"):
+        audio_file = capture_audio()
     print("Recording complete.")
     if audio_file:
         # Transcribe the spoken input
-        transcript = transcribe_speech(audio_file, whisper_model, language)
+        with tracing.span("transcribe"):
+            transcript = transcribe_speech(audio_file, whisper_model, language)
         os.remove(audio_file)
         return transcript
\ No newline at end of file
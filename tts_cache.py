@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import unicodedata
+from typing import Dict, Optional
+
+CACHE_DIRECTORY = ".tts_cache/"
+
+# total size the cache may grow to before the least recently used entries are evicted
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# eviction trims the cache to this share of MAX_CACHE_BYTES, so it isn't rescanned on every put once full
+EVICT_TO_RATIO = 0.9
+
+# hit/miss/eviction counters for this process
+STATS: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+_LOCK = threading.Lock()
+_TOTAL_BYTES: Optional[int] = None
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text so that differences in unicode form or whitespace don't produce separate cache entries.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text: str, voice: str, settings: Dict[str, str]) -> str:
+    """
+    Returns the content address of a piece of synthesized speech.
+
+    Args:
+        text (str): The text that was synthesized.
+        voice (str): The ShortName of the voice used.
+        settings (Dict[str, str]): Any other synthesis settings that change the audio (rate, volume, ...).
+
+    Returns:
+        key (str): The hex digest identifying the audio.
+    """
+    payload = json.dumps([normalize_text(text), voice, settings], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _path(key: str) -> str:
+    return os.path.join(CACHE_DIRECTORY, key[:2], key + ".mp3")
+
+
+def _entries():
+    """
+    Yields (path, size, mtime) for every cached file.
+    """
+    if not os.path.isdir(CACHE_DIRECTORY):
+        return
+    for shard in os.scandir(CACHE_DIRECTORY):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if entry.name.endswith(".mp3"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # evicted by another process while we were scanning
+                    continue
+                yield entry.path, stat.st_size, stat.st_mtime
+
+
+def get(key: str) -> Optional[bytes]:
+    """
+    Returns the cached MP3 bytes for a key, or None on a miss. A hit marks the entry as recently used.
+
+    Args:
+        key (str): The key returned by cache_key.
+
+    Returns:
+        audio (Optional[bytes]): The cached MP3 bytes.
+    """
+    path = _path(key)
+    try:
+        with open(path, "rb") as f:
+            audio = f.read()
+        # the modification time doubles as the last use time for LRU eviction
+        os.utime(path)
+    except FileNotFoundError:
+        with _LOCK:
+            STATS["misses"] += 1
+        return None
+    with _LOCK:
+        STATS["hits"] += 1
+    return audio
+
+
+def put(key: str, audio: bytes) -> None:
+    """
+    Stores MP3 bytes under a key and evicts the least recently used entries if the cache is over budget.
+    The file is written under a temporary name and renamed into place, so other processes
+    sharing the cache never see a partial file.
+
+    Args:
+        key (str): The key returned by cache_key.
+        audio (bytes): The MP3 bytes to store.
+    """
+    global _TOTAL_BYTES
+    path = _path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(audio)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    with _LOCK:
+        # an entry being overwritten no longer counts towards the total
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        try:
+            os.replace(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        if _TOTAL_BYTES is None:
+            _TOTAL_BYTES = sum(size for _, size, _ in _entries())
+        else:
+            _TOTAL_BYTES += len(audio) - replaced
+        if _TOTAL_BYTES > MAX_CACHE_BYTES:
+            _evict()
+
+
+def _evict() -> None:
+    """
+    Deletes the least recently used entries until the cache is down to EVICT_TO_RATIO of MAX_CACHE_BYTES.
+    """
+    global _TOTAL_BYTES
+    # rescan, other processes may have added or removed entries since our estimate
+    entries = sorted(_entries(), key=lambda entry: entry[2])
+    total = sum(size for _, size, _ in entries)
+    target = MAX_CACHE_BYTES * EVICT_TO_RATIO
+    for path, size, _ in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            STATS["evictions"] += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    _TOTAL_BYTES = total
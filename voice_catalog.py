@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+SNAPSHOT_FILE = ".voices.json"
+
+# how long a saved voice list is trusted before we try to refresh it
+SNAPSHOT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# how long to wait for the voice list endpoint before falling back to a stale snapshot
+FETCH_TIMEOUT_SECONDS = 5
+
+# ShortNames indexed by (language, gender), e.g. ("es", "Female")
+INDEX: Dict[Tuple[str, str], List[str]] = {}
+
+# the voice picked for each (language, gender) during this session, so it doesn't change mid-conversation
+PINNED_VOICES: Dict[Tuple[str, str], str] = {}
+
+# the load in progress, so concurrent callers on the same event loop share one download
+_LOADING: Optional[asyncio.Task] = None
+
+
+def _build_index(voices: List[dict]) -> Dict[Tuple[str, str], List[str]]:
+    index: Dict[Tuple[str, str], List[str]] = {}
+    for voice in voices:
+        language = voice["Locale"].split("-")[0]
+        index.setdefault((language, voice["Gender"]), []).append(voice["ShortName"])
+    return index
+
+
+def _read_snapshot() -> Optional[dict]:
+    try:
+        with open(SNAPSHOT_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_snapshot(voices: List[dict]) -> None:
+    # write to a temporary file and rename it so a crash never leaves a truncated snapshot
+    directory = os.path.dirname(os.path.abspath(SNAPSHOT_FILE))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": time.time(), "voices": voices}, f)
+        os.replace(temp_path, SNAPSHOT_FILE)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+async def load() -> None:
+    """
+    Loads the voice catalog into INDEX. A fresh snapshot is used as is; otherwise the voice list is
+    downloaded and saved, falling back to a stale snapshot if the endpoint is unreachable or slow.
+    """
+    global _LOADING
+    if INDEX:
+        return
+    if _LOADING is None or _LOADING.get_loop() is not asyncio.get_running_loop() or _LOADING.done():
+        _LOADING = asyncio.create_task(_load())
+    await asyncio.shield(_LOADING)
+
+
+async def _load() -> None:
+    import edge_tts
+
+    global INDEX
+    snapshot = _read_snapshot()
+    if snapshot is not None and time.time() - snapshot["fetched_at"] < SNAPSHOT_TTL_SECONDS:
+        INDEX = _build_index(snapshot["voices"])
+        return
+
+    try:
+        voices = await asyncio.wait_for(edge_tts.list_voices(), FETCH_TIMEOUT_SECONDS)
+    except Exception as e:
+        if snapshot is None:
+            raise Exception(f"Could not download the voice list and no snapshot is saved: {e}")
+        print(f"Could not refresh the voice list, using the saved snapshot: {e}")
+        INDEX = _build_index(snapshot["voices"])
+        return
+
+    try:
+        _write_snapshot(voices)
+    except OSError as e:
+        print(f"Error saving the voice list snapshot: {e}")
+    INDEX = _build_index(voices)
+
+
+async def select_voice(language: str, gender: str, pinned_voices: Optional[Dict[Tuple[str, str], str]] = None) -> str:
+    """
+    Returns the voice ShortName to use for a language and gender. The first call picks one of the
+    matching voices at random and every later call in this session returns the same voice.
+
+    Args:
+        language (str): The language of the voice (e.g. 'en' for English).
+        gender (str): The gender of the voice, 'Male' or 'Female'.
+        pinned_voices (Optional[Dict[Tuple[str, str], str]]): Where the session's voices are pinned. Default is PINNED_VOICES.
+
+    Returns:
+        voice (str): The ShortName of the selected voice.
+    """
+    if pinned_voices is None:
+        pinned_voices = PINNED_VOICES
+    key = (language.lower(), gender)
+    if key in pinned_voices:
+        return pinned_voices[key]
+
+    await load()
+    voice_candidates = INDEX.get(key)
+    if not voice_candidates:
+        raise Exception(f"No voices found for language '{language}' and gender '{gender}'")
+
+    return pinned_voices.setdefault(key, random.choice(voice_candidates))